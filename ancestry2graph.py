@@ -24,6 +24,7 @@ import sys, argparse, pandas as pd
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Process AncestryDNA data dump (26 Jun 2016)', add_help = False, usage = 'ancestry2graph.py -g <guid> -l <label> [options]')
     parser.add_argument('-d', action = 'store_true', default = False, help = 'whether to remove distant cousins [False]')
+    parser.add_argument('-z', metavar = '<INT>', type = int, help = 'number of lines to process at a time [all]')
     try:
         parser.add_argument('-i', metavar = '<FILE>', type = argparse.FileType('r', encoding = 'UTF-8'), default = sys.stdin, help = 'input matches file [stdout]')
         parser.add_argument('-o', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stdout, help = 'output graph file [stdout]')
@@ -40,41 +41,39 @@ if __name__ == '__main__':
         parser.print_help()
         exit(2)
 
-    df = pd.read_csv(args.i, sep = '\t')
-    user_guid = df.iloc[0]['testGuid']
-    user_label = df.iloc[0]['matchTestDisplayName']
-    user_gender = df.iloc[0]['subjectGender']
-    df.loc[~df['matchTestSubjectIsAdmin'],'matchTestDisplayName'] += ' (administered by ' + df.loc[~df['matchTestSubjectIsAdmin'],'matchTestAdminDisplayName'] + ')'
-    guid_label = pd.Series(df['matchTestDisplayName'].values, index = df['testGuid']).to_dict()
-    guid_gender = pd.Series(df['subjectGender'].values, index = df['testGuid']).to_dict()
+    # only the columns needed are loaded and the matches file can be processed in chunks
+    # (edges between the user and each match and between each match and its shared matches are kept in the order of the input matches file)
+    usecols = ['testGuid', 'matchTestDisplayName', 'matchTestAdminDisplayName', 'matchTestSubjectIsAdmin', 'subjectGender', 'meiosisValue', 'sharedCentimorgans', 'matchesInCommon']
+    dtype = { 'testGuid': str, 'matchTestDisplayName': str, 'matchTestAdminDisplayName': str, 'subjectGender': 'category', 'sharedCentimorgans': float, 'matchesInCommon': str }
+    chunks = pd.read_csv(args.i, sep = '\t', usecols = lambda x: x in usecols, dtype = dtype, chunksize = args.z) if args.z else [pd.read_csv(args.i, sep = '\t', usecols = lambda x: x in usecols, dtype = dtype)]
+    guid_label = dict()
+    guid_gender = dict()
+    edges = list()
+    for df in chunks:
+        if not guid_label:
+            user_guid = df.iloc[0]['testGuid']
+        df.loc[~df['matchTestSubjectIsAdmin'],'matchTestDisplayName'] += ' (administered by ' + df.loc[~df['matchTestSubjectIsAdmin'],'matchTestAdminDisplayName'] + ')'
+        guid_label.update(zip(df['testGuid'], df['matchTestDisplayName']))
+        guid_gender.update(zip(df['testGuid'], df['subjectGender']))
 
-    df2 = pd.DataFrame(columns = ['p1', 'l1', 'g1', 'p2', 'l2', 'g2', 'cm'])
-    for i in df.index[df['meiosisValue']<10] if args.d else df.index:
-        testGuid = df['testGuid'][i]
-        if user_guid == testGuid:
-            continue
-        cm = df['sharedCentimorgans'][i]
-        pidx = hash(tuple(sorted([user_guid, testGuid])))
-        if not pidx in df2.index:
-            df2.set_value(pidx, 'p1', user_guid)
-            df2.set_value(pidx, 'l1', user_label)
-            df2.set_value(pidx, 'g1', user_gender)
-            df2.set_value(pidx, 'p2', testGuid)
-            df2.set_value(pidx, 'l2', guid_label[testGuid])
-            df2.set_value(pidx, 'g2', guid_gender[testGuid])
-            df2.set_value(pidx, 'cm', cm)
-        if pd.notnull(df['matchesInCommon'][i]):
-            for guid in df['matchesInCommon'][i].split(','):
-                if not guid in guid_label:
-                    sys.stderr.write('Warning: ' + guid + ' not in input matches file\n')
-                    continue
-                pidx = hash(tuple(sorted([testGuid, guid])))
-                if not pidx in df2.index:
-                    df2.set_value(pidx, 'p1', testGuid)
-                    df2.set_value(pidx, 'l1', guid_label[testGuid])
-                    df2.set_value(pidx, 'g1', guid_gender[testGuid])
-                    df2.set_value(pidx, 'p2', guid)
-                    df2.set_value(pidx, 'l2', guid_label[guid])
-                    df2.set_value(pidx, 'g2', guid_gender[guid])
-                    df2.set_value(pidx, 'cm', float('NaN'))
-    df2.to_csv(args.o, sep = '\t', na_rep = 'NA', index = False)
+        rows = df.loc[df['meiosisValue']<10] if args.d else df
+        rows = rows.loc[rows['testGuid'] != user_guid]
+        edges.append(pd.DataFrame({ 'p1': user_guid, 'p2': rows['testGuid'], 'cm': rows['sharedCentimorgans'] }))
+        rows = rows.loc[rows['matchesInCommon'].notnull()]
+        edges.append(pd.DataFrame({ 'p1': rows['testGuid'], 'p2': rows['matchesInCommon'].str.split(','), 'cm': float('NaN') }).explode('p2'))
+    df2 = pd.concat(edges).sort_index(kind = 'mergesort').reset_index(drop = True)
+    idx = df2['p2'].isin(set(guid_label))
+    for guid in df2.loc[~idx.values, 'p2']:
+        sys.stderr.write('Warning: ' + guid + ' not in input matches file\n')
+    df2 = df2.loc[idx.values]
+
+    # remove duplicate pairs using the sorted pair of guids as key
+    idx = df2['p1'] < df2['p2']
+    pairs = pd.DataFrame({ 'a': df2['p1'].where(idx, df2['p2']), 'b': df2['p2'].where(idx, df2['p1']) })
+    df2 = df2.loc[~pairs.duplicated().values].copy()
+
+    df2['l1'] = df2['p1'].map(guid_label)
+    df2['g1'] = df2['p1'].map(guid_gender)
+    df2['l2'] = df2['p2'].map(guid_label)
+    df2['g2'] = df2['p2'].map(guid_gender)
+    df2.to_csv(args.o, sep = '\t', columns = ['p1', 'l1', 'g1', 'p2', 'l2', 'g2', 'cm'], na_rep = 'NA', index = False)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+   bench_parse_23andme.py - Benchmark of parsing 23andMe profile, inheritance and user pages
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, os, argparse, time, re, json, html.parser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from getmy23andme import parse_profiles, parse_inheritance, parse_gender
+
+# these are the parsers used before the extractors were compiled once, as they were in Session
+def old_profiles(text):
+    text = html.parser.unescape(re.sub(' *\n *', '', text))
+    regexp = re.compile('dataLayer = \\[.*?\\];')
+    res = regexp.search(text)
+    line = text[res.span()[0]:res.span()[1]]
+    dataLayer = json.loads(line[12:-1])
+    ids = [dataLayer[0]['profile_id']]
+    regexp = re.compile('<div class=\"(profile-name|user-name)\">.*?</div>')
+    res = regexp.search(text)
+    line = text[res.span()[0]:res.span()[1]]
+    labels = [re.sub('  *', ' ', re.sub('<.*?>', ' ', line)).strip()]
+    regexp = re.compile('<li><a id=\"profile_option_' + '[a-z0-9]' * 16 + '\" class=\"profile_option\" href=\"#\">.*?</a></li>')
+    for res in regexp.finditer(text):
+        line = text[res.span()[0]:res.span()[1]]
+        ids.append(line[26:42])
+        labels.append(line[76:-9])
+    return (dataLayer, { 'people_ids': ids, 'people_labels': labels })
+
+def old_inheritance(text):
+    text = html.parser.unescape(re.sub(' *\n *', '', text))
+    regexp = re.compile('var inheritance = new Inheritance\\(\'genome_view\', {.*?}\\);')
+    res = regexp.search(text)
+    line = text[res.span()[0]:res.span()[1]]
+    return json.loads(line[49:-2])
+
+def old_gender(text):
+    text = html.parser.unescape(re.sub(' *\n *', '', text))
+    regexp = re.compile('<p><strong>Sex:</strong>(Female|Male)</p>')
+    res = regexp.search(text)
+    if res:
+        line = text[res.span()[0]:res.span()[1]]
+        return line[24:-4]
+    else:
+        return 'Unknown'
+
+def timeit(f, text, repeats):
+    start = time.time()
+    for i in range(repeats):
+        f(text)
+    return (time.time() - start) / repeats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark of parsing 23andMe profile, inheritance and user pages', add_help = False, usage = 'bench_parse_23andme.py [options]')
+    parser.add_argument('-r', metavar = '<INT>', type = int, default = 200, help = 'number of times each page is parsed [200]')
+    parser.add_argument('-d', metavar = '<DIR>', type = str, default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'), help = 'directory with the saved pages [fixtures]')
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    # pages are unescaped once as Session.get_url does before they are parsed
+    sys.stdout.write('page\tbytes\tnew_ms\told_ms\n')
+    for name, new, old in ('23andme_you.html', parse_profiles, old_profiles), ('23andme_inheritance.html', parse_inheritance, old_inheritance), ('23andme_user.html', parse_gender, old_gender):
+        with open(os.path.join(args.d, name), encoding = 'UTF-8') as f:
+            text = html.parser.unescape(f.read())
+        if new(text) != old(text):
+            sys.stderr.write('Error: parsers disagree on ' + name + '\n')
+            exit(1)
+        sys.stdout.write(name + '\t' + str(len(text)) + '\t' + '%.3f' % (1000 * timeit(new, text, args.r)) + '\t' + '%.3f' % (1000 * timeit(old, text, args.r)) + '\n')
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+   bench_records_to_frame.py - Benchmark of building match tables from records
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, os, argparse, time, random, pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tables import records_to_frame
+
+KEYS = ['dnaMatch', 'lastLoggedInDate', 'megaBases', 'ignored', 'testGuid', 'hasHint', 'starred', 'matchTreeId', 'matchTreeNodeCount', 'matchTestAdminDisplayName', 'hasNote', 'userPhoto', 'sharedCentimorgans', 'matchTreeDisplayName', 'matchTestDisplayName', 'matchTreeIsPrivate', 'meiosisValue', 'matchTestSubjectIsAdmin', 'note', 'subjectGender', 'viewed', 'confidence']
+
+# records look like the matches of getmyancestrydna.py -x with a few more fields than the fixed keys
+def get_records(n, fields = 50):
+    rnd = random.Random(0)
+    extra = ['field' + str(i) for i in range(fields - len(KEYS))]
+    return [dict({ key: rnd.random() for key in KEYS + extra }, testGuid = 'M' + str(i)) for i in range(n)]
+
+# this is how the tables were built before records_to_frame, one cell at a time
+# (DataFrame.set_value no longer exists so DataFrame.at, which behaves the same way, is used instead)
+def cell_by_cell(records, keys):
+    df = pd.DataFrame(columns = keys)
+    for record in records:
+        for key, value in record.items():
+            df.at[record['testGuid'], key] = value
+    return df
+
+def timeit(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark of building match tables from records', add_help = False, usage = 'bench_records_to_frame.py [options]')
+    parser.add_argument('-n', metavar = '<INT>', nargs = '+', type = int, default = [1000, 2000, 5000, 10000, 20000], help = 'numbers of matches [1000 2000 5000 10000 20000]')
+    parser.add_argument('-m', metavar = '<INT>', type = int, default = 2000, help = 'largest number of matches to build cell by cell [2000]')
+    parser.add_argument('-f', metavar = '<INT>', type = int, default = 50, help = 'number of fields per match [50]')
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    sys.stdout.write('matches\trecords_to_frame\tcell_by_cell\n')
+    for n in args.n:
+        records = get_records(n, args.f)
+        fast = timeit(records_to_frame, records, KEYS)
+        slow = '%.3f' % timeit(cell_by_cell, records, KEYS) if n <= args.m else 'NA'
+        sys.stdout.write(str(n) + '\t' + '%.3f' % fast + '\t' + slow + '\n')
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+   bench_triangulation.py - Benchmark of grouping overlapping IBD segments
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, os, argparse, time, tracemalloc, numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ibdview2triangulation import get_groups
+
+# segments of 1 to 20 megabases are spread over the 22 autosomes among pairs of random individuals
+def get_segments(n, individuals, focal = False):
+    rnd = np.random.RandomState(0)
+    chrom = rnd.randint(0, 22, n).astype(np.int8)
+    start = rnd.randint(0, 250000000, n).astype(np.int64)
+    end = start + rnd.randint(1000000, 20000000, n)
+    p1 = np.zeros(n, dtype = np.int64) if focal else rnd.randint(0, individuals, n)
+    p2 = rnd.randint(1, individuals, n)
+    return chrom, start, end, p1, p2
+
+# groups are consumed as they are yielded, as ibdview2triangulation.py writes them, while the peak of traced memory is recorded
+def run(segments, n):
+    tracemalloc.start()
+    start = time.time()
+    groups, members = 0, 0
+    for begin, finish, k, seg in get_groups(*segments, n = n):
+        groups += 1
+        members += len(seg)
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return groups, members, seconds, peak
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark of grouping overlapping IBD segments', add_help = False, usage = 'bench_triangulation.py [options]')
+    parser.add_argument('-n', metavar = '<INT>', nargs = '+', type = int, default = [50000, 100000, 200000], help = 'numbers of segments [50000 100000 200000]')
+    parser.add_argument('-i', metavar = '<INT>', type = int, default = 10000, help = 'number of individuals [10000]')
+    parser.add_argument('-k', metavar = '<INT>', type = int, default = 3, help = 'minimum number of individuals in a group [3]')
+    parser.add_argument('-f', action = 'store_true', default = False, help = 'whether all segments are shared with one focal individual [False]')
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    sys.stdout.write('segments\tgroups\tmembers\tseconds\tpeak_mb\n')
+    for n in args.n:
+        groups, members, seconds, peak = run(get_segments(n, args.i, args.f), args.k)
+        sys.stdout.write(str(n) + '\t' + str(groups) + '\t' + str(members) + '\t' + '%.3f' % seconds + '\t' + '%.1f' % (peak / 1e6) + '\n')
@@ -19,7 +19,8 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, getpass, time, re, json, html.parser, pandas as pd, csv
+import sys, argparse, os, getpass, time, re, json, html.parser, threading, itertools, dbm, pandas as pd, csv, ibdstore, tables, sessions
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import requests
@@ -28,32 +29,68 @@ except ImportError:
     sys.stderr.write('(run this in your terminal: "python3 -m pip install requests" or "python3 -m pip install --user requests")\n')
     exit(2)
 
-class Session:
-    def __init__(self, username, password, verbose, logfile, timeout):
+# patterns are compiled once and allow for whitespace and newlines between tags so that pages are scanned as downloaded
+DATALAYER = re.compile(r'dataLayer\s*=\s*(\[.*?\]);', re.S)
+PROFILE_NAME = re.compile(r'<div class="(?:profile-name|user-name)">(.*?)</div>', re.S)
+PROFILE_OPTION = re.compile(r'<li>\s*<a id="profile_option_([a-z0-9]{16})" class="profile_option" href="#">\s*(.*?)\s*</a>\s*</li>', re.S)
+INHERITANCE = re.compile(r"var inheritance = new Inheritance\('genome_view',\s*(\{.*?\})\);", re.S)
+SEX = re.compile(r'<p>\s*<strong>Sex:</strong>\s*(Female|Male)\s*</p>')
+TAG = re.compile(r'<.*?>', re.S)
+SPACES = re.compile(r'\s+')
+
+# this function extracts the list of profiles from the https://www.23andme.com/you/ page
+def parse_profiles(text):
+    dataLayer = json.loads(DATALAYER.search(text).group(1))
+    ids = [dataLayer[0]['profile_id']]
+    labels = [SPACES.sub(' ', TAG.sub(' ', PROFILE_NAME.search(text).group(1))).strip()]
+    for res in PROFILE_OPTION.finditer(text):
+        ids.append(res.group(1))
+        labels.append(res.group(2))
+    return (dataLayer, { 'people_ids': ids, 'people_labels': labels })
+
+# this function extracts the JSON variable embedded in the https://www.23andme.com/you/inheritance/ page
+def parse_inheritance(text):
+    return json.loads(INHERITANCE.search(text).group(1))
+
+# this function extracts the sex from a https://www.23andme.com/user/ profile page
+def parse_gender(text):
+    res = SEX.search(text)
+    return res.group(1) if res else 'Unknown'
+
+class Session(sessions.BaseSession):
+    def __init__(self, username, password, verbose, logfile, timeout, checkpoint = None, resume = False, connect_timeout = 10, backoff = 1.0, max_backoff = 300, workers = 1, rate = None):
+        sessions.BaseSession.__init__(self, verbose, logfile, timeout, connect_timeout, backoff, max_backoff, workers, rate, checkpoint, resume)
         self.username = username
         self.password = password
-        self.verbose = verbose
-        self.logfile = logfile
-        self.timeout = timeout
-        self.s = requests.Session()
+        self.login_lock = threading.Lock()
+        self.logins = 0
         self.login()
 
+    # when the session expires all worker threads find out at once so only the first one logs in again
+    # (a thread whose request was sent before the last login just retries it with the new cookies)
+    def relogin(self, logins):
+        with self.login_lock:
+            if self.logins == logins:
+                self.login()
+                self.logins += 1
+
     def login(self):
         url = 'https://www.23andme.com/cas/signin/'
         data = { 'username': self.username, 'password': self.password, '__source_node__': 'start', '__form__': 'login'}
-        while True:
+        for attempt in itertools.count():
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloading: ' + url + '\n')
             try:
-                r = self.s.post(url, data = data, timeout = self.timeout)
+                r = self.send('POST', url, data = data)
             except requests.exceptions.ReadTimeout:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Read timed out\n')
+                self.wait(attempt)
                 continue
             except requests.exceptions.ConnectionError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Connection aborted\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Status code: ' + str(r.status_code) + '\n')
@@ -63,22 +100,28 @@ class Session:
 
     def get_url(self, url, xhr = False, data = None):
         headers = { 'X-Requested-With': 'XMLHttpRequest' } if xhr else None
-        while True:
+        key = url + (' ' + json.dumps(data, sort_keys = True) if data else '')
+        if key in self.store:
+            return self.store[key]
+        for attempt in itertools.count():
+            self.throttle(url)
+            logins = self.logins
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloading: ' + url + (' ' + str(data) if data else '') + '\n')
             try:
                 if data:
-                    r = self.s.post(url, cookies = self.cookies, data = data, headers = headers, timeout = self.timeout)
+                    r = self.send('POST', url, cookies = self.cookies, data = data, headers = headers)
                 else:
-                    r = self.s.get(url, cookies = self.cookies, headers = headers, timeout = self.timeout)
+                    r = self.send('GET', url, cookies = self.cookies, headers = headers)
             except requests.exceptions.ReadTimeout:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Read timed out\n')
+                self.wait(attempt)
                 continue
             except requests.exceptions.ConnectionError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Connection aborted\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Status code: ' + str(r.status_code) + '\n')
@@ -87,52 +130,31 @@ class Session:
             except requests.exceptions.HTTPError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: HTTPError\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             text = html.parser.unescape(r.text)
             if self.verbose and xhr:
                 self.logfile.write(text + '\n')
             if r.text == '191919':
-                self.login()
+                self.relogin(logins)
             else:
+                self.save_checkpoint(key, text)
                 return text
 
+    # each page is requested once per run so it is scanned as downloaded and its parsed value is not kept
+    def parse(self, url, parser):
+        return parser(self.get_url(url))
+
     # this function retrieves the list of profiles from the https://www.23andme.com/you/ page
     # (maybe there is a more direct way to request this list but I could not figure it out)
     def get_profiles(self):
-        text = self.get_url('https://www.23andme.com/you/')
-        text = html.parser.unescape(re.sub(' *\n *', '', text))
-
-        regexp = re.compile('dataLayer = \[.*?\];')
-        res = regexp.search(text)
-        line = text[res.span()[0]:res.span()[1]]
-        dataLayer = json.loads(line[12:-1])
-        ids = [dataLayer[0]['profile_id']]
-
-        regexp = re.compile('<div class=\"(profile-name|user-name)\">.*?</div>')
-        res = regexp.search(text)
-        line = text[res.span()[0]:res.span()[1]]
-        labels = [re.sub('  *', ' ', re.sub('<.*?>', ' ', line)).strip()]
-
-        regexp = re.compile('<li><a id=\"profile_option_' + '[a-z0-9]' * 16 + '\" class=\"profile_option\" href=\"#\">.*?</a></li>')
-        for res in regexp.finditer(text):
-          line = text[res.span()[0]:res.span()[1]]
-          ids.append(line[26:42])
-          labels.append(line[76:-9])
-
-        return (dataLayer, { 'people_ids': ids, 'people_labels': labels })
-    
+        return self.parse('https://www.23andme.com/you/', parse_profiles)
+
     # this function retrieves the JSON variable embedded in the https://www.23andme.com/you/inheritance/ page
     # (maybe there is a more direct way to request the JSON variable but I could not figure it out)
     def get_inheritance(self):
-        text = self.get_url('https://www.23andme.com/you/inheritance/')
-        text = html.parser.unescape(re.sub(' *\n *', '', text))
-    
-        regexp = re.compile('var inheritance = new Inheritance\(\'genome_view\', {.*?}\);')
-        res = regexp.search(text)
-        line = text[res.span()[0]:res.span()[1]]
-        return json.loads(line[49:-2])
-    
+        return self.parse('https://www.23andme.com/you/inheritance/', parse_inheritance)
+
     def get_relfinder(self, uid):
         text = self.get_url('https://www.23andme.com/you/relfinder/fetch/?profile_id=' + uid, True)
         return json.loads(text)
@@ -155,27 +177,30 @@ class Session:
         if uid in ['v$SP1_MOTHER_V4', 'v$SP1_DAUGHTER_V2', 'v$SP1_MOTHERS_MOTHER_V2']:
             return 'Female'
 
-        text = self.get_url('https://www.23andme.com/user/?profile=' + uid)
-        text = html.parser.unescape(re.sub(' *\n *', '', text))
+        return self.parse('https://www.23andme.com/user/?profile=' + uid, parse_gender)
 
-        regexp = re.compile('<p><strong>Sex:</strong>(Female|Male)</p>')
-        res = regexp.search(text)
-        if res:
-            line = text[res.span()[0]:res.span()[1]]
-            return line[24:-4]
-        else:
-            return 'Unknown'
+# pairs are indexed by their sorted profile ids so that (p1, p2) and (p2, p1) share the same key across runs
+def pair_key(p1, p2):
+    return '\t'.join(sorted([p1, p2]))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Retrieve DNA matches from 23andMe (26 Jun 2016)', add_help = False, usage = 'getmy23andme.py -u <username> -p <password> [options]')
     parser.add_argument('-u', metavar = '<STR>', type = str, help = '23andMe username [prompt]')
     parser.add_argument('-p', metavar = '<STR>', type = str, help = '23andMe password [prompt]')
     parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to use verbose mode [False]')
-    parser.add_argument('-t', metavar = '<INT>', type = int, default = 60, help = 'timeout in seconds [60]')
+    parser.add_argument('-t', metavar = '<INT>', type = int, default = 60, help = 'read timeout in seconds [60]')
+    parser.add_argument('-tc', metavar = '<INT>', type = int, default = 10, help = 'connect timeout in seconds [10]')
+    parser.add_argument('-b', metavar = '<FLOAT>', type = float, default = 1.0, help = 'initial delay in seconds before retrying a failed request [1.0]')
+    parser.add_argument('-j', metavar = '<INT>', type = int, default = 1, help = 'number of concurrent downloads [1]')
+    parser.add_argument('-r', metavar = '<FLOAT>', type = float, help = 'maximum number of requests per second per host [unlimited]')
     parser.add_argument('-o', metavar = '<STR>', type = str, help = 'output prefix [account_id]')
+    parser.add_argument('-k', metavar = '<FILE>', type = str, help = 'checkpoint file where downloaded responses are saved')
+    parser.add_argument('-resume', action = 'store_true', default = False, help = 'whether to reuse the responses saved in the checkpoint file [False]')
     parser.add_argument('-x', action = 'store_true', default = False, help = 'whether to download inheritance and ibdview tables [False]')
-    parser.add_argument('-h', metavar = '<FILE>', type = str, help = 'previously downloaded inheritance table file')
+    parser.add_argument('-h', metavar = '<FILE>', type = str, help = 'previously downloaded inheritance table file (ignored when -d is given)')
     parser.add_argument('-i', metavar = '<FILE>', type = str, help = 'previously downloaded ibdview table file')
+    parser.add_argument('-d', metavar = '<FILE>', type = str, help = 'index file of ibdview pairs already downloaded')
+    parser.add_argument('-g', metavar = '<FILE>', type = str, help = 'gender cache file shared across accounts and runs')
     try:        
         parser.add_argument('-l', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stderr, help = 'output log file [stderr]')
     except TypeError:
@@ -191,11 +216,15 @@ if __name__ == '__main__':
         parser.print_help()
         exit(2)
 
+    if args.k and not args.resume and os.path.exists(args.k):
+        sys.stderr.write('Checkpoint file ' + args.k + ' already exists, use -resume to reuse its responses or remove it\n')
+        exit(2)
+
     username = args.u if args.u else input("Enter 23andMe username: ")
     password = args.p if args.p else getpass.getpass("Enter 23andMe password: ")
 
     # initialize a session with 23andMe server
-    session = Session(username, password, args.v, args.l, args.t)
+    session = Session(username, password, args.v, args.l, args.t, checkpoint = args.k, resume = args.resume, connect_timeout = args.tc, backoff = args.b, workers = args.j, rate = args.r)
 
     # download list of profiles handled in the account
     dataLayer, profiles = session.get_profiles()
@@ -207,14 +236,10 @@ if __name__ == '__main__':
     for ehid in profiles['people_ids']:
         relfinder = session.get_relfinder(ehid)
         keys = ['share_status', 'desc', 'eiid', 'rel_upper', 'match_id', 'max_grandparents_same_country', 'patside', 'resend_date', 'segs', 'year', 'ehid', 'birth_country_maternal_gma', 'first', 'res', 'rel_alt', 'url', 'birth_country_maternal_gpa', 'first_initial', 'rel_alg', 'last', 'first_name', 'visible', 'tree_url', 'rel_alg_label', 'disc', 'last_initial', 'pct', 'anc', 'locs', 'matside', 'full', 'pat', 'invitation_status', 'rel_label', 'hide_rel', 'favorite', 'new_share_status', 'birth', 'eid', 'mat', 'rel_range', 'rel_lower', 'img', 'self_reported_ashkenazi', 'rel_user', 'updated', 'can_resend', 'sex', 'birth_country_paternal_gma', 'last_name', 'added', 'surs', 'birth_country_paternal_gpa', 'intro_status']
-        df = pd.DataFrame(columns = keys)
-        i = 0
         for match in relfinder['matches']:
             if match['ehid']:
                 gender[match['ehid']] = match['sex']
-            for key, value in match.items():
-                df.set_value(i, key, value)
-            i += 1
+        df = tables.records_to_frame(relfinder['matches'], keys)
         df.to_csv(out + '.' + ehid + '.relfinder.tsv', sep = '\t', na_rep = 'NA', index = False)
 
     # download list of IBD segments for each profile (discontinued as of June 2016)
@@ -222,43 +247,86 @@ if __name__ == '__main__':
       for ehid in profiles['people_ids']:
           ancfinder = session.get_ancestry_finder(ehid)
           keys = ['num', 'ehid', 'label', 'sl', 'nd', 'cm', 'st', 'pgf_ashk', 'pgf_bc', 'pgm_ashk', 'pgm_bc', 'mgf_ashk', 'mgf_bc', 'mgm_ashk', 'mgm_bc']
-          df = pd.DataFrame(columns = keys)
-          i = 0
+          records = list()
           for num, match in ancfinder['ancfinder_result']['af_record'].items():
               for segment in match['segments']:
-                  df.set_value(i, 'num', num)
+                  record = { 'num': num }
                   if 'public_data' in match:
-                      df.set_value(i, 'ehid', match['public_data']['profile_url'][15:])
-                      df.set_value(i, 'label', match['public_data']['label'])
-                  for key, value in segment.items():
-                      df.set_value(i, key, value)
+                      record['ehid'] = match['public_data']['profile_url'][15:]
+                      record['label'] = match['public_data']['label']
+                  record.update(segment)
                   for x in 'p', 'm':
                       for y in 'f', 'm':
                           for z in 'ashk', 'bc':
-                              df.set_value(i, x + 'g' + y + '_' + z, match['ancestry'][x + 'g' + y][z])
-                  i += 1
+                              record[x + 'g' + y + '_' + z] = match['ancestry'][x + 'g' + y][z]
+                  records.append(record)
+          df = tables.records_to_frame(records, keys)
           df.to_csv(out + '.' + ehid + '.ancfinder.tsv', sep = '\t', na_rep = 'NA', index = False)
 
     # download match details for each pair of shared profiles
     if args.x:
-        if args.h and args.i:
+        # without a pair index, pairs of profiles both in the previous inheritance table are assumed to be already downloaded
+        if args.h and args.i and not args.d:
             inheritance = pd.read_csv(args.h, sep = '\t')
             people_ids = set(inheritance['people_ids'])
+        if args.i:
             df = pd.read_csv(args.i, sep = '\t')
         else:
             keys = ['p2', 'unassayble_regions', 'function_call', 'p1', 'intervals']
             df = pd.DataFrame(columns = keys)
+        # the index records every pair ever downloaded, including those not sharing any DNA which are not in the ibdview table
+        # (it is seeded once from the previous ibdview table when empty and pairs sharing DNA are skipped only if that table is given)
+        index = dbm.open(args.d, 'c') if args.d else dict()
+        if len(index) == 0:
+            for p1, p2 in zip(df['p1'], df['p2']):
+                index[pair_key(p1, p2)] = b'1'
+        skip = lambda p1, p2: pair_key(p1, p2) in index and (args.i or index[pair_key(p1, p2)] == b'0')
         inheritance = session.get_inheritance()
-        inheritance['gender'] = [gender[uid] if uid in gender else session.get_gender(uid) for uid in inheritance['people_ids']]
+        # genders come from the relfinder matches or from the gender cache and only the remaining profiles are downloaded
+        # (profiles of unknown gender are not cached so that they are looked up again in the next run)
+        if args.g and os.path.isfile(args.g):
+            cache = pd.read_csv(args.g, sep = '\t', dtype = str)
+        else:
+            cache = pd.DataFrame(columns = ['people_ids', 'people_labels', 'gender'])
+        known = dict(zip(cache['people_ids'], cache['gender']))
+        known.update(gender)
+        missing = [uid for uid in set(inheritance['people_ids']) if not uid in known]
+        with ThreadPoolExecutor(args.j) as executor:
+            known.update(zip(missing, executor.map(session.get_gender, missing)))
+        inheritance['gender'] = [known[uid] for uid in inheritance['people_ids']]
+        if args.g:
+            df_gender = pd.DataFrame({ 'people_ids': inheritance['people_ids'], 'people_labels': inheritance['people_labels'], 'gender': inheritance['gender'] })
+            df_gender = pd.concat([cache, df_gender.loc[df_gender['gender'].notnull() & (df_gender['gender'] != 'Unknown')]], ignore_index = True)
+            df_gender.drop_duplicates('people_ids', keep = 'last').to_csv(args.g, sep = '\t', columns = ['people_ids', 'people_labels', 'gender'], na_rep = 'NA', index = False)
         pd.DataFrame({ 'people_ids': inheritance['people_ids'], 'people_labels': inheritance['people_labels'], 'gender': inheritance['gender'] }).to_csv(out + '.inheritance.tsv', sep = '\t', na_rep = 'NA', index = False)
+        records = list()
         null = '{"20": [[], []], "21": [[], []], "22": [[], []], "1": [[], []], "3": [[], []], "2": [[], []], "5": [[], []], "4": [[], []], "7": [[], []], "6": [[], []], "9": [[], []], "8": [[], []], "Y": [[], []], "X": [[], []], "11": [[], []], "10": [[], []], "13": [[], []], "12": [[], []], "15": [[], []], "14": [[], []], "17": [[], []], "16": [[], []], "19": [[], []], "18": [[], []]}'
-        for i in range(len(inheritance['people_ids'])):
-            for j in range(0,i):
-                p1 = inheritance['people_ids'][j]
-                p2 = inheritance['people_ids'][i]
-                if not (args.h and args.i and p1 in people_ids and p2 in people_ids):
-                    ibdview = session.get_ibdview(p1, p2)
+        ids = inheritance['people_ids']
+        pairs = [(ids[j], ids[i]) for i in range(len(ids)) for j in range(0,i) if not (skip(ids[j], ids[i]) or args.h and args.i and not args.d and ids[j] in people_ids and ids[i] in people_ids)]
+        # pairs of profiles in the account or among their DNA relatives are the most likely to share DNA so they are downloaded first
+        relatives = set(gender) | set(profiles['people_ids'])
+        pairs.sort(key = lambda pair: (pair[0] in relatives) + (pair[1] in relatives), reverse = True)
+        start = time.time()
+        block = 100 * args.j
+        downloaded = dict()
+        with ThreadPoolExecutor(args.j) as executor:
+            for k in range(0, len(pairs), block):
+                for pair, ibdview in zip(pairs[k:k + block], executor.map(lambda pair: session.get_ibdview(pair[0], pair[1]), pairs[k:k + block])):
                     if ibdview['intervals'] != null:
-                        for key, value in ibdview.items():
-                            df.set_value(hash((p1, p2)), key, value)
+                        records.append(ibdview)
+                    downloaded[pair_key(pair[0], pair[1])] = b'1' if ibdview['intervals'] != null else b'0'
+                if args.v:
+                    done = min(k + block, len(pairs))
+                    eta = (time.time() - start) / done * (len(pairs) - done)
+                    args.l.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloaded ' + str(done) + ' of ' + str(len(pairs)) + ' ibdview pairs, ETA: ' + str(int(eta)) + ' seconds\n')
+        df = pd.concat([df, tables.records_to_frame(records, list(df.columns))], ignore_index = True)
         df.to_csv(out + '.ibdview.tsv', sep = '\t', na_rep = 'NA', index = False, quoting = csv.QUOTE_NONE)
+        ibdstore.save_segments(out + '.ibdview.npz', ibdstore.intervals_to_segments(df['p1'], df['p2'], df['intervals']))
+        # pairs are added to the index only once their segments are in the ibdview table so that an interrupted run loses none
+        for key, value in downloaded.items():
+            index[key] = value
+        if args.d:
+            index.close()
+
+    if args.v:
+        session.print_stats()
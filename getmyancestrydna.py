@@ -19,7 +19,8 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, getpass, time, re, json, pandas as pd
+import sys, argparse, os, getpass, time, re, json, threading, itertools, collections, dbm, pandas as pd, numpy as np, tables, sessions
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import requests
@@ -28,34 +29,34 @@ except ImportError:
     sys.stderr.write('(run this in your terminal: "python3 -m pip install requests" or "python3 -m pip install --user requests")\n')
     exit(2)
 
-class Session:
-    def __init__(self, username, password, verbose, logfile, timeout, urlpfx = 'https://www.ancestry.com/dna/secure/'):
+class Session(sessions.BaseSession):
+    def __init__(self, username, password, verbose, logfile, timeout, urlpfx = 'https://www.ancestry.com/dna/secure/', workers = 1, rate = None, checkpoint = None, resume = False, connect_timeout = 10, backoff = 1.0, max_backoff = 300, cache = None, ttl = 86400, lru = 10000):
+        sessions.BaseSession.__init__(self, verbose, logfile, timeout, connect_timeout, backoff, max_backoff, workers, rate, checkpoint, resume)
         self.username = username
         self.password = password
-        self.verbose = verbose
-        self.logfile = logfile
-        self.timeout = timeout
         self.urlpfx = urlpfx
-        self.s = requests.Session()
+        self.open_cache(cache, ttl, lru)
+        self.stats.update(hits = 0, misses = 0)
         # self.dnaVersion = self.get_dna_version()
         self.login()
 
     # This does not seem required anymore
     def get_dna_version(self):
         url = 'http://www.ancestry.com/dna/'
-        while True:
+        for attempt in itertools.count():
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloading: ' + url + '\n')
             try:
-                r = self.s.get(url, timeout = self.timeout)
+                r = self.send('GET', url)
             except requests.exceptions.ReadTimeout:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Read timed out\n')
+                self.wait(attempt)
                 continue
             except requests.exceptions.ConnectionError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Connection aborted\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Status code: ' + str(r.status_code) + '\n')
@@ -64,7 +65,7 @@ class Session:
             except requests.exceptions.HTTPError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: HTTPError\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             text = re.findall(r'var dna.*?=\s*(.*?);', r.text, re.DOTALL | re.MULTILINE)[0] # http://stackoverflow.com/questions/18368058/how-can-i-parse-javascript-variables-using-python
             text = re.sub('([a-zA-Z0-9]*) ?: ?({|\'|true|false|!1)', '"\g<1>": \g<2>', text) # enclose property names in double quotes
@@ -76,25 +77,26 @@ class Session:
             except:
                 if self.verbose:
                     self.logfile.write(r.text + '\n')
-                time.sleep(self.timeout)
-                self.s = requests.Session() # sometimes the session will repeatedly fail and will need to be reset
+                self.wait(attempt)
+                self.s = self.new_session() # sometimes the session will repeatedly fail and will need to be reset
 
     def login(self):
         url = 'https://www.ancestry.com/secure/login'
         data = { 'username': self.username, 'password': self.password}
-        while True:
+        for attempt in itertools.count():
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloading: ' + url + '\n')
             try:
-                r = self.s.post(url, data = data, timeout = self.timeout)
+                r = self.send('POST', url, data = data)
             except requests.exceptions.ReadTimeout:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Read timed out\n')
+                self.wait(attempt)
                 continue
             except requests.exceptions.ConnectionError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Connection aborted\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Status code: ' + str(r.status_code) + '\n')
@@ -102,26 +104,99 @@ class Session:
             self.cookies = { 'ATT': cookies['ATT'] }
             return
 
-    def get_url(self, url):
+    # responses are cached in memory with LRU eviction and optionally on disk so that they are shared across tests and runs
+    # (entries older than ttl seconds are ignored and the on-disk tier is a dbm file of JSON encoded [time, response] pairs)
+    # (only responses requested with a normalized key are kept in memory as no other response is requested twice in a run)
+    def open_cache(self, cache, ttl, lru):
+        self.ttl = ttl
+        self.lru = lru
+        self.cache = collections.OrderedDict()
+        self.disk = dbm.open(cache, 'c') if cache else None
+        self.inflight = dict()
+
+    def close_cache(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    # this function must be called while holding the lock
+    def get_cached(self, key, memory = True):
+        if key in self.cache:
+            entry = self.cache.pop(key)
+        elif self.disk is not None and key in self.disk:
+            entry = json.loads(self.disk[key].decode('utf-8'))
+        else:
+            return None
+        if self.ttl and time.time() - entry[0] > self.ttl:
+            return None
+        if memory:
+            self.cache[key] = entry
+        return entry
+
+    # this function must be called while holding the lock
+    def set_cached(self, key, response, memory = True):
+        entry = [time.time(), response]
+        if memory:
+            self.cache[key] = entry
+            while len(self.cache) > self.lru:
+                self.cache.popitem(last = False)
+        if self.disk is not None:
+            self.disk[key] = json.dumps(entry).encode('utf-8')
+
+    # identical requests are served from the cache and a request already in flight in another thread is waited for
+    # (requests whose response depends on less than the full url can pass a normalized key shared across tests)
+    def get_url(self, url, key = None):
+        memory = key is not None
+        key = key if key else url
         while True:
+            with self.lock:
+                entry = self.get_cached(key, memory)
+                if entry:
+                    self.stats['hits'] += 1
+                    return entry[1]
+                event = self.inflight.get(key)
+                if not event:
+                    self.stats['misses'] += 1
+                    event = self.inflight[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            response = self.download(url, key)
+            with self.lock:
+                self.set_cached(key, response, memory)
+            return response
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+
+    # the checkpoint is indexed by the same key as the cache so that a saved response is found whichever test requests it
+    # (responses saved under their url by earlier versions are still found)
+    def download(self, url, key = None):
+        key = key if key else url
+        for k in key, url:
+            if k in self.store:
+                return self.store[k]
+        for attempt in itertools.count():
+            self.throttle(url)
             # headers = { 'dnaVersion' : self.dnaVersion }
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloading: ' + url + '\n')
             try:
-                r = self.s.get(url, cookies = self.cookies, timeout = self.timeout)
+                r = self.send('GET', url, cookies = self.cookies)
             except requests.exceptions.ReadTimeout:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Read timed out\n')
+                self.wait(attempt)
                 continue
             except requests.exceptions.ConnectionError:
                 if self.verbose:
                     self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Connection aborted\n')
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if self.verbose:
                 self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Status code: ' + str(r.status_code) + '\n')
             if r.status_code == 503:
-                time.sleep(self.timeout)
+                self.wait(attempt)
                 continue
             if r.status_code == 426:
                 if self.verbose:
@@ -130,7 +205,9 @@ class Session:
                 continue
             if self.verbose:
                 self.logfile.write(r.text + '\n')
-            return r.json() if r.text else r.text
+            response = r.json() if r.text else r.text
+            self.save_checkpoint(key, response)
+            return response
 
     def get_tests(self):
         url = self.urlpfx + 'tests'
@@ -142,7 +219,10 @@ class Session:
         testinfo = self.get_url(url)
         return testinfo
 
-    def get_matches(self, guid, guidMatch = None):
+    # matches are sorted by relationship so paging stops at the first page with a match outside the thresholds
+    # (all later pages are outside the thresholds too and matches outside them on the last page downloaded are dropped)
+    def get_matches(self, guid, guidMatch = None, mincm = None, maxmeiosis = None):
+        keep = lambda match: (mincm is None or float(match['sharedCentimorgans']) >= mincm) and (maxmeiosis is None or match['meiosisValue'] <= maxmeiosis)
         page = 1
         pages = list()
         while True:
@@ -153,11 +233,13 @@ class Session:
                 url = self.urlpfx + 'tests/' + guid + '/matches?page=' + str(page)
             matches = self.get_url(url)
             pages.append(matches)
+            if (mincm is not None or maxmeiosis is not None) and not all(keep(match) for group in matches['matchGroups'] for match in group['matches']):
+                break
             if page < matches['pageCount']:
                 page += 1
             else:
                 break
-        return [match for page in pages for group in page['matchGroups'] for match in group['matches']]
+        return [match for page in pages for group in page['matchGroups'] for match in group['matches'] if keep(match)]
 
     def get_match_info(self, guid, testGuid):
         url = self.urlpfx + 'tests/' + guid + '/matches/' + testGuid
@@ -166,7 +248,8 @@ class Session:
 
     def get_match_ethnicity(self, guid, testGuid):
         url = self.urlpfx + 'tests/' + guid + '/matches/' + testGuid + '/ethnicity'
-        ethnicity = self.get_url(url)
+        # the ethnicity of a match does not depend on the test it is matched with
+        ethnicity = self.get_url(url, 'ethnicity:' + testGuid)
         return ethnicity
 
     def get_parents(self, guid):
@@ -174,14 +257,101 @@ class Session:
         parents = self.get_url(url)
         return parents
 
+    # this function retrieves ethnicity, shared segments and shared matches for a single match
+    # (it is called from worker threads so it must not touch anything but the session)
+    def get_match_details(self, guid, testGuid, parents):
+        details = dict()
+        ethnicity = self.get_match_ethnicity(guid, testGuid)
+        if ethnicity:
+            for key, value in ethnicity.items():
+                details[key] = ','.join(value) if value else 'NA'
+        matchInfo = self.get_match_info(guid, testGuid)
+        details['cadGroups'] = str(matchInfo['cadGroups']) if matchInfo['cadGroups'] else 'NA'
+        details['sharedSegments'] = str(matchInfo['sharedSegments']) if matchInfo['sharedSegments'] else 0
+        matchesInCommon = self.get_matches(guid, testGuid)
+        shared = [match['testGuid'] for match in matchesInCommon]
+        details['patside'] = parents['father']['testGuid'] in shared
+        details['matside'] = parents['mother']['testGuid'] in shared
+        details['matchesInCommon'] = ','.join(shared) if shared else 'NA'
+        return details
+
+# this function returns the details downloaded in a previous run for a match that has not changed since
+# (new matches or matches whose shared centimorgans or last login date changed return None)
+# (centimorgans are compared as numbers as they might be sent as strings and might not round trip exactly through the table)
+# (matches without shared matches might have been skipped for being below a previous -xcm so they are reused only if still below it)
+def get_previous_details(match, prev, shared_mincm = None):
+    if not match['testGuid'] in prev.index:
+        return None
+    row = prev.loc[match['testGuid']]
+    for key in 'sharedCentimorgans', 'lastLoggedInDate':
+        if not key in row or pd.isnull(match.get(key)) and pd.isnull(row[key]):
+            continue
+        if pd.isnull(match.get(key)) or pd.isnull(row[key]):
+            return None
+        if key == 'sharedCentimorgans' and not np.isclose(float(match[key]), float(row[key])):
+            return None
+        if key != 'sharedCentimorgans' and str(match[key]) != str(row[key]):
+            return None
+    if pd.isnull(row.get('matchesInCommon')) and (shared_mincm is None or float(match['sharedCentimorgans']) >= shared_mincm):
+        return None
+    return { key: value for key, value in row.items() if not key in match }
+
+# this function downloads the matches of a single test and writes them to <out>.<guid>.tsv as soon as they are complete
+# (match details are downloaded through an executor that can be shared with other tests)
+def download_test(session, executor, guid, out, shared = False, prefix = None, logfile = sys.stderr, mincm = None, maxmeiosis = None, shared_mincm = None):
+    parents = session.get_parents(guid)
+    testinfo = session.get_testinfo(guid)
+    keys = ['dnaMatch', 'lastLoggedInDate', 'megaBases', 'ignored', 'testGuid', 'hasHint', 'starred', 'matchTreeId', 'matchTreeNodeCount', 'matchTestAdminDisplayName', 'hasNote', 'userPhoto', 'sharedCentimorgans', 'matchTreeDisplayName', 'matchTestDisplayName', 'matchTreeIsPrivate', 'meiosisValue', 'matchTestSubjectIsAdmin', 'note', 'subjectGender', 'viewed', 'confidence']
+    records = dict()
+    records[guid] = { 'testGuid': guid, 'matchTestDisplayName': testinfo['givenNames'] + ' ' + testinfo['surname'], 'subjectGender': testinfo['gender'], 'meiosisValue': 0, 'hasHint': True, 'matchTestSubjectIsAdmin': True }
+    if shared:
+        records[guid]['patside'] = True
+        records[guid]['matside'] = True
+    # only new or changed matches need their details downloaded again
+    # (the full list of matches is still downloaded as it is sorted by relationship rather than by date)
+    prev = pd.DataFrame()
+    if prefix and shared:
+        try:
+            prev = pd.read_csv(prefix + '.' + guid + '.tsv', sep = '\t', index_col = 'testGuid', dtype = { 'lastLoggedInDate': str }, float_precision = 'round_trip')
+        except FileNotFoundError:
+            sys.stderr.write('Warning: ' + prefix + '.' + guid + '.tsv not found\n')
+        if not 'matchesInCommon' in prev:
+            prev = pd.DataFrame()
+    matches = session.get_matches(guid, mincm = mincm, maxmeiosis = maxmeiosis)
+    # shared matches are only downloaded for matches above their own threshold
+    # (matches below it are recorded as sharing no match so that they are still plotted, on neither side)
+    below = { 'patside': False, 'matside': False, 'matchesInCommon': 'NA' }
+    get_details = lambda match: get_previous_details(match, prev, shared_mincm) or (session.get_match_details(guid, match['testGuid'], parents) if shared_mincm is None or float(match['sharedCentimorgans']) >= shared_mincm else dict(below))
+    details = executor.map(get_details, matches) if shared else [dict() for match in matches]
+    for match, detail in zip(matches, details):
+        records[match['testGuid']] = dict(match, **detail)
+    df = tables.records_to_frame(list(records.values()), keys)
+    df.to_csv(out + '.' + guid + '.tsv', sep = '\t', na_rep = 'NA', index = False)
+    if session.verbose:
+        logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Downloaded ' + str(len(matches)) + ' matches of test ' + guid + '\n')
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Retrieve DNA matches from AncestryDNA (26 Jun 2016)', add_help = False, usage = 'getmyancestrydna.py -u <username> -p <password> [options]')
     parser.add_argument('-u', metavar = '<STR>', type = str, help = 'AncestryDNA username [prompt]')
     parser.add_argument('-p', metavar = '<STR>', type = str, help = 'AncestryDNA password [prompt]')
     parser.add_argument('-x', action = 'store_true', default = False, help = 'whether to download the list of shared matches [False]')
+    parser.add_argument('-xcm', metavar = '<FLOAT>', type = float, help = 'minimum shared centiMorgans of the matches whose shared matches are downloaded')
+    parser.add_argument('-cm', metavar = '<FLOAT>', type = float, help = 'minimum shared centiMorgans of the matches to download')
+    parser.add_argument('-mv', metavar = '<INT>', type = int, help = 'maximum meiosis value of the matches to download')
+    parser.add_argument('-i', metavar = '<STR>', type = str, help = 'prefix of previously downloaded matches files to update (requires -x)')
     parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to use verbose mode [False]')
-    parser.add_argument('-t', metavar = '<INT>', type = int, default = 60, help = 'timeout in seconds [60]')
+    parser.add_argument('-t', metavar = '<INT>', type = int, default = 60, help = 'read timeout in seconds [60]')
+    parser.add_argument('-tc', metavar = '<INT>', type = int, default = 10, help = 'connect timeout in seconds [10]')
+    parser.add_argument('-b', metavar = '<FLOAT>', type = float, default = 1.0, help = 'initial delay in seconds before retrying a failed request [1.0]')
+    parser.add_argument('-j', metavar = '<INT>', type = int, default = 1, help = 'number of concurrent downloads [1]')
+    parser.add_argument('-J', metavar = '<INT>', type = int, default = 1, help = 'number of tests processed concurrently [1]')
+    parser.add_argument('-r', metavar = '<FLOAT>', type = float, help = 'maximum number of requests per second per host [unlimited]')
     parser.add_argument('-o', metavar = '<STR>', type = str, help = 'output prefix [ucdmId]')
+    parser.add_argument('-k', metavar = '<FILE>', type = str, help = 'checkpoint file where downloaded responses are saved')
+    parser.add_argument('-C', metavar = '<FILE>', type = str, help = 'on-disk response cache shared across runs')
+    parser.add_argument('-ttl', metavar = '<INT>', type = int, default = 86400, help = 'seconds after which cached responses expire (0 for never) [86400]')
+    parser.add_argument('-lru', metavar = '<INT>', type = int, default = 10000, help = 'maximum number of shared responses cached in memory [10000]')
+    parser.add_argument('-resume', action = 'store_true', default = False, help = 'whether to reuse the responses saved in the checkpoint file [False]')
     try:        
         parser.add_argument('-l', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stderr, help = 'output log file [stderr]')
     except TypeError:
@@ -197,57 +367,40 @@ if __name__ == '__main__':
         parser.print_help()
         exit(2)
 
+    if args.k and not args.resume and os.path.exists(args.k):
+        sys.stderr.write('Checkpoint file ' + args.k + ' already exists, use -resume to reuse its responses or remove it\n')
+        exit(2)
+
+    if args.i and not args.x:
+        sys.stderr.write('Warning: -i is ignored without -x as only shared match details are reused from previous files\n')
+
     username = args.u if args.u else input("Enter AncestryDNA username: ")
     password = args.p if args.p else getpass.getpass("Enter AncestryDNA password: ")
 
     # initialize a session with AncestryDNA server
-    session = Session(username, password, args.v, args.l, args.t)
+    session = Session(username, password, args.v, args.l, args.t, workers = args.j + args.J, rate = args.r, checkpoint = args.k, resume = args.resume, connect_timeout = args.tc, backoff = args.b, cache = args.C, ttl = args.ttl, lru = args.lru)
 
     # download list of tests handled in the account
     tests = session.get_tests()
     out = args.o if args.o else tests['data']['completeTests'][0]['testAdminUcdmId']
     keys = ['shippedToLabOn', 'activationCode', 'activatedOn', 'role', 'state', 'lastUpdated', 'processingBegan', 'testAdminDisplayName', 'testAdminUcdmId', 'usersSelfTest', 'recollectable', 'adminDisplayName', 'privateName', 'gender', 'surname', 'ucdmId', 'givenNames', 'notificationCount', 'selfTest', 'guid']
-    df_tests = pd.DataFrame(columns = keys)
+    records = list()
     for test in tests['data']['completeTests']:
+        record = dict()
         for key, value in test.items():
             if key == 'testSubject':
-                for key2, value2 in value.items():
-                    df_tests.set_value(test['guid'], key2, value2)
+                record.update(value)
             else:
-                df_tests.set_value(test['guid'], key, value)
+                record[key] = value
+        records.append(record)
+    df_tests = tables.records_to_frame(records, keys)
     df_tests.to_csv(out + '.tsv', sep = '\t', na_rep = 'NA', index = False)
 
     # download match details for each test
-    for guid in df_tests['guid']:
-        parents = session.get_parents(guid)
-        testinfo = session.get_testinfo(guid)
-        keys = ['dnaMatch', 'lastLoggedInDate', 'megaBases', 'ignored', 'testGuid', 'hasHint', 'starred', 'matchTreeId', 'matchTreeNodeCount', 'matchTestAdminDisplayName', 'hasNote', 'userPhoto', 'sharedCentimorgans', 'matchTreeDisplayName', 'matchTestDisplayName', 'matchTreeIsPrivate', 'meiosisValue', 'matchTestSubjectIsAdmin', 'note', 'subjectGender', 'viewed', 'confidence']
-        df = pd.DataFrame(columns = keys)
-        df.set_value(guid, 'testGuid', guid)
-        df.set_value(guid, 'matchTestDisplayName', testinfo['givenNames'] + ' ' + testinfo['surname'])
-        df.set_value(guid, 'subjectGender', testinfo['gender'])
-        df.set_value(guid, 'meiosisValue', 0)
-        df.set_value(guid, 'hasHint', True)
-        df.set_value(guid, 'matchTestSubjectIsAdmin', True)
-        if args.x:
-            df.set_value(guid, 'patside', True)
-            df.set_value(guid, 'matside', True)
-        matches = session.get_matches(guid)
-        for match in matches:
-            for key, value in match.items():
-                df.set_value(match['testGuid'], key, value)
-            if args.x:
-                ethnicity = session.get_match_ethnicity(guid, match['testGuid'])
-                if ethnicity:
-                    for key, value in ethnicity.items():
-                        df.set_value(match['testGuid'], key, ','.join(value) if value else 'NA')
-                matchInfo = session.get_match_info(guid, match['testGuid'])
-                df.set_value(match['testGuid'], 'cadGroups', str(matchInfo['cadGroups']) if matchInfo['cadGroups'] else 'NA')
-                df.set_value(match['testGuid'], 'sharedSegments', str(matchInfo['sharedSegments']) if matchInfo['sharedSegments'] else 0)
-                matchesInCommon = session.get_matches(guid, match['testGuid'])
-                shared = [match['testGuid'] for match in matchesInCommon]
-                df.set_value(match['testGuid'], 'patside', parents['father']['testGuid'] in shared)
-                df.set_value(match['testGuid'], 'matside', parents['mother']['testGuid'] in shared)
-                df.set_value(match['testGuid'], 'matchesInCommon', ','.join(shared) if shared else 'NA')
-                
-        df.to_csv(out + '.' + guid + '.tsv', sep = '\t', na_rep = 'NA', index = False)
+    # (tests are processed concurrently while the match details of all tests share a single pool and the session rate limit)
+    with ThreadPoolExecutor(args.j) as executor, ThreadPoolExecutor(args.J) as tests_executor:
+        list(tests_executor.map(lambda guid: download_test(session, executor, guid, out, args.x, args.i, args.l, args.cm, args.mv, args.xcm), df_tests['guid']))
+
+    session.close_cache()
+    if args.v or args.C:
+        session.print_stats()
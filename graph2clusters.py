@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+   graph2clusters.py - Find clusters of relatives in AncestryDNA/23andMe matches graph
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, argparse, pandas as pd, numpy as np
+
+# this function builds the adjacency of an undirected graph in compressed sparse row format
+def get_csr(i1, i2, n):
+    rows = np.concatenate([i1, i2])
+    cols = np.concatenate([i2, i1])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = n))])
+    return indptr, cols[np.argsort(rows, kind = 'mergesort')]
+
+# each node takes the smallest label among itself and its neighbors until nothing changes
+# (labels are also replaced by the label of their own node which halves the number of iterations needed)
+def get_components(indptr, indices):
+    n = len(indptr) - 1
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, rows, labels[indices])
+        new = new[new]
+        if (new == labels).all():
+            return labels
+        labels = new
+
+# each node takes the most frequent label among itself and its neighbors (ties go to the smallest label)
+# (all nodes are updated at once with a single sort of the (node, label) votes)
+def get_communities(indptr, indices, iterations = 100):
+    n = len(indptr) - 1
+    rows = np.concatenate([np.repeat(np.arange(n), np.diff(indptr)), np.arange(n)])
+    labels = np.arange(n)
+    for i in range(iterations):
+        votes, counts = np.unique(rows * n + np.concatenate([labels[indices], labels]), return_counts = True)
+        node, label = votes // n, votes % n
+        order = np.lexsort((label, -counts, node))
+        first = order[np.concatenate([[True], node[order][1:] != node[order][:-1]])]
+        new = np.empty(n, dtype = labels.dtype)
+        new[node[first]] = label[first]
+        if (new == labels).all():
+            break
+        labels = new
+    return labels
+
+# Leeds method: matches in the seed range are visited from the closest and each one not yet assigned
+# starts a cluster with all unassigned seed matches it shares DNA with
+def get_leeds(indptr, indices, seeds):
+    labels = np.full(len(indptr) - 1, -1)
+    is_seed = np.zeros(len(indptr) - 1, dtype = bool)
+    is_seed[seeds] = True
+    for seed in seeds:
+        if labels[seed] >= 0:
+            continue
+        neighbors = indices[indptr[seed]:indptr[seed + 1]]
+        neighbors = neighbors[is_seed[neighbors] & (labels[neighbors] < 0)]
+        labels[seed] = seed
+        labels[neighbors] = seed
+    return labels
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Find clusters of relatives in AncestryDNA/23andMe matches graph (26 Jun 2016)', add_help = False, usage = 'graph2clusters.py [options]')
+    parser.add_argument('-t', metavar = '<CHAR>', type = str, default = 'tab', help = 'separator [tab]')
+    parser.add_argument('-a', metavar = '<STR>', type = str, default = 'components', choices = ['components', 'communities', 'leeds'], help = 'clustering method (components, communities or leeds) [components]')
+    parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to remove HapMap/Mendel/Fisher 23andMe individuals [False]')
+    parser.add_argument('-r', metavar = '<IID>', nargs = '+', type = str, help = 'list of individuals to remove')
+    parser.add_argument('-R', metavar = '<FILE>', type = str, help = 'file with individuals to remove')
+    parser.add_argument('-cm', metavar = '<FLOAT>', type = float, help = 'minimum number of centiMorgans')
+    parser.add_argument('-anc', metavar = '<FILE>', type = str, help = 'AncestryDNA matches file (required by the leeds method)')
+    parser.add_argument('-lo', metavar = '<FLOAT>', type = float, default = 90.0, help = 'minimum centiMorgans shared with seed matches of the leeds method [90.0]')
+    parser.add_argument('-hi', metavar = '<FLOAT>', type = float, default = 400.0, help = 'maximum centiMorgans shared with seed matches of the leeds method [400.0]')
+    try:
+        parser.add_argument('-i', metavar = '<FILE>', type = argparse.FileType('r', encoding = 'UTF-8'), default = sys.stdin, help = 'input graph file [stdin]')
+        parser.add_argument('-o', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stdout, help = 'output clusters file [stdout]')
+    except TypeError:
+        sys.stderr.write('Python >= 3.4 is required to run this script\n')
+        sys.stderr.write('(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n')
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    if args.a == 'leeds' and not args.anc:
+        sys.stderr.write('The leeds method requires an AncestryDNA matches file\n')
+        exit(2)
+
+    # the test owner shares DNA with every match so it is removed as otherwise it would join all clusters together
+    remove = set()
+    if args.r:
+        remove |= set(args.r)
+    if args.R:
+        df = pd.read_csv(args.R, sep = '\t')
+        if 'people_ids' in df:
+            remove |= set(df['people_ids'])
+        elif 'testGuid' in df:
+            remove |= set(df['testGuid'])
+    if args.anc:
+        dfa = pd.read_csv(args.anc, sep = '\t')
+        remove |= set(dfa.loc[dfa['meiosisValue'] == 0, 'testGuid'])
+
+    dtype = { 'p1': str, 'p2': str, 'l1': str, 'l2': str, 'mb': float, 'cm': float }
+    df = pd.read_csv(args.i, sep = '\t' if args.t == 'tab' else args.t, dtype = dtype)
+    if args.v:
+        df = df.loc[~df['p1'].str.startswith('v$') & ~df['p2'].str.startswith('v$')]
+    if remove:
+        df = df.loc[~df['p1'].isin(remove) & ~df['p2'].isin(remove)]
+    if args.cm and 'cm' in df:
+        df = df.loc[df['cm'].isnull() | (df['cm'] > args.cm)]
+
+    # map individuals to consecutive integers
+    iids, idx = np.unique(np.concatenate([df['p1'].values, df['p2'].values]).astype(str), return_inverse = True)
+    i1, i2 = idx[:len(df)], idx[len(df):]
+    label = dict(zip(df['p1'], df['l1']))
+    label.update(zip(df['p2'], df['l2']))
+    indptr, indices = get_csr(i1, i2, len(iids))
+
+    if args.a == 'components':
+        labels = get_components(indptr, indices)
+    elif args.a == 'communities':
+        labels = get_communities(indptr, indices)
+    else:
+        seed = dfa.loc[(dfa['sharedCentimorgans'] >= args.lo) & (dfa['sharedCentimorgans'] <= args.hi)].sort_values('sharedCentimorgans', ascending = False)
+        pos = pd.Series(np.arange(len(iids)), index = iids)
+        seeds = pos.reindex(seed['testGuid'].values).dropna().astype(int).values
+        labels = get_leeds(indptr, indices, seeds)
+
+    # clusters are numbered from the largest
+    out = pd.DataFrame({ 'iid': iids, 'label': [label[iid] for iid in iids], 'cluster': labels })
+    out = out.loc[out['cluster'] >= 0]
+    size = out.groupby('cluster')['iid'].transform('size')
+    rank = pd.DataFrame({ 'cluster': out['cluster'], 'size': size }).drop_duplicates().sort_values(['size', 'cluster'], ascending = [False, True])
+    out = out.assign(cluster = out['cluster'].map(pd.Series(np.arange(len(rank)), index = rank['cluster'].values)), size = size)
+    columns = ['cluster', 'size', 'iid', 'label']
+    if args.anc and 'patside' in dfa and 'matside' in dfa:
+        out['patside'] = out['iid'].map(dict(zip(dfa['testGuid'], dfa['patside'])))
+        out['matside'] = out['iid'].map(dict(zip(dfa['testGuid'], dfa['matside'])))
+        columns += ['patside', 'matside']
+    out.sort_values(['cluster', 'iid']).to_csv(args.o, sep = '\t', columns = columns, na_rep = 'NA', index = False)
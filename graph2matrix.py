@@ -19,7 +19,20 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, pandas as pd, re
+import sys, argparse, pandas as pd, numpy as np, re
+
+# this function writes the non-zero cells in Matrix Market coordinate format with the labels as comments
+def write_mtx(f, labels, rows, cols, data):
+    f.write('%%MatrixMarket matrix coordinate real general\n')
+    for i, label in enumerate(labels):
+        f.write('% ' + str(i + 1) + ' ' + str(label) + '\n')
+    f.write(str(len(labels)) + ' ' + str(len(labels)) + ' ' + str(len(data)) + '\n')
+    pd.DataFrame({ 'row': rows + 1, 'col': cols + 1, 'data': data }).to_csv(f, sep = ' ', header = False, index = False, na_rep = 'nan')
+
+# this function writes the matrix in the layout of scipy.sparse.save_npz plus an array of labels
+# (so that it can be loaded back with scipy.sparse.load_npz)
+def write_npz(f, labels, rows, cols, data):
+    np.savez_compressed(f, format = b'coo', shape = np.array([len(labels), len(labels)]), row = rows, col = cols, data = data, labels = np.array(labels, dtype = str))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Convert AncestryDNA/23andMe matches graph to matrix (26 Jun 2016)', add_help = False, usage = 'graph2matrix.py [options]')
@@ -29,6 +42,8 @@ if __name__ == '__main__':
     parser.add_argument('-c', action = 'store_true', default = False, help = 'whether to convert special characters to _ [False]')
     parser.add_argument('-g', action = 'store_true', default = False, help = 'whether to use genetic distance rather than physical distance [False]')
     parser.add_argument('-h', metavar = '<FILE>', type = str, help = '23andMe inheritance table file')
+    parser.add_argument('-z', metavar = '<INT>', type = int, help = 'number of lines to process at a time [all]')
+    parser.add_argument('-f', metavar = '<STR>', type = str, default = 'tsv', choices = ['tsv', 'mtx', 'npz'], help = 'output format (tsv, mtx or npz) [tsv]')
     try:
         parser.add_argument('-i', metavar = '<FILE>', type = argparse.FileType('r', encoding = 'UTF-8'), default = sys.stdin, help = 'input graph file [stdout]')
         parser.add_argument('-o', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stdout, help = 'output matrix file [stdout]')
@@ -45,33 +60,56 @@ if __name__ == '__main__':
         parser.print_help()
         exit(2)
 
-    df = pd.read_csv(args.i, sep = '\t')
-    if args.v:
-        idx = df['p1'].apply(lambda x: x[0:2]!='v$') & df['p2'].apply(lambda x: x[0:2]!='v$')
-        df = df.loc[idx]
-    if args.c:
-        df['l1'] = df['l1'].apply(lambda x: re.sub('[ .]','_',x))
-        df['l2'] = df['l2'].apply(lambda x: re.sub('[ .]','_',x))
     if args.h:
         dfh = pd.read_csv(args.h, sep = '\t')
         if args.c:
             dfh['people_labels'] = dfh['people_labels'].apply(lambda x: re.sub('[ .]','_',x))
         columns = dfh['people_labels'].values.tolist() if args.l else dfh['people_ids'].values.tolist()
+        index = { iid: i for i, iid in enumerate(columns) }
     else:
-        columns = list(set(df['l1']) | set(df['l2']) if args.l else set(df['p1']) | set(df['p2']))
-    mat = pd.DataFrame(columns = columns, index = columns, dtype = float)
-    mat.fillna(0, inplace = True)
-    iid = [None, None]
-    for i in df.index:
-        i1 = df['l1' if args.l else 'p1'][i]
-        if pd.isnull(i1) or not i1 in columns:
+        index = dict()
+
+    # the graph file can be processed in chunks so that only the matrix indexes are kept in memory
+    dtype = { 'p1': str, 'p2': str, 'l1': 'category', 'l2': 'category', 'g1': 'category', 'g2': 'category', 'mb': float, 'cm': float }
+    chunks = pd.read_csv(args.i, sep = '\t', dtype = dtype, chunksize = args.z) if args.z else [pd.read_csv(args.i, sep = '\t', dtype = dtype)]
+    edges = list()
+    for df in chunks:
+        if args.v:
+            idx = ~df['p1'].str.startswith('v$') & ~df['p2'].str.startswith('v$')
+            df = df.loc[idx].copy()
+        if args.c:
+            df['l1'] = df['l1'].apply(lambda x: re.sub('[ .]','_',x))
+            df['l2'] = df['l2'].apply(lambda x: re.sub('[ .]','_',x))
+        if not args.h:
+            for iid in pd.concat([df['l1'], df['l2']] if args.l else [df['p1'], df['p2']]).unique():
+                index.setdefault(iid, len(index))
+        i1 = df['l1' if args.l else 'p1'].map(index).astype(float)
+        i2 = df['l2' if args.l else 'p2'].map(index).astype(float)
+        for i in df.index[i1.isnull().values]:
             sys.stderr.write('Warning: ' + str(df['l1'][i]) + ', ' + str(df['p1'][i]) + ' not in input inheritance file\n')
-            continue
-        i2 = df['l2' if args.l else 'p2'][i]
-        if pd.isnull(i2) or not i2 in columns:
+        for i in df.index[(i1.notnull() & i2.isnull()).values]:
             sys.stderr.write('Warning: ' + str(df['l2'][i]) + ', ' + str(df['p2'][i]) + ' not in input inheritance file\n')
-            continue
-        shared = df['cm' if args.g else 'mb'][i] if 'mb' in df or 'cm' in df else 1
-        mat[i1][i2] = shared
-        mat[i2][i1] = shared
-    mat.to_csv(args.o, sep = '\t' if args.t == 'tab' else args.t, na_rep = 'NA')
+        idx = (i1.notnull() & i2.notnull()).values
+        shared = df['cm' if args.g else 'mb'].values[idx].astype(float) if 'mb' in df or 'cm' in df else np.ones(idx.sum())
+        edges.append((i1.values[idx].astype(int), i2.values[idx].astype(int), shared))
+    if not args.h:
+        columns = list(index)
+    i1, i2, shared = (np.concatenate(x) for x in zip(*edges))
+
+    # each edge fills both symmetric cells and a later edge between the same pair overwrites an earlier one
+    rows = np.stack([i1, i2], axis = 1).ravel()
+    cols = np.stack([i2, i1], axis = 1).ravel()
+    data = np.repeat(shared, 2)
+    _, last = np.unique((rows * len(columns) + cols)[::-1], return_index = True)
+    last = len(rows) - 1 - last
+    rows, cols, data = rows[last], cols[last], data[last]
+
+    if args.f == 'mtx':
+        write_mtx(args.o, columns, rows, cols, data)
+    elif args.f == 'npz':
+        args.o.flush()
+        write_npz(args.o.buffer, columns, rows, cols, data)
+    else:
+        mat = np.zeros((len(columns), len(columns)))
+        mat[rows, cols] = data
+        pd.DataFrame(mat, index = columns, columns = columns).to_csv(args.o, sep = '\t' if args.t == 'tab' else args.t, na_rep = 'NA')
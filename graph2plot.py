@@ -19,50 +19,140 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, pandas as pd, re, matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import sys, argparse, os, json, hashlib, shlex, copy, importlib.util, pandas as pd, numpy as np, re, matplotlib
 
-try:
-    import networkx as nx
-except ImportError:
-    sys.stderr.write('You need to install the networkx module first\n')
-    sys.stderr.write('(run this in your terminal: "python -m pip install networkx" or "python -m pip install --user networkx")\n')
-    exit(2)
+# this function computes the two leading non-trivial eigenvectors of the normalized adjacency matrix by orthogonal iteration
+# (the sparse product is computed with bincount so that no dense matrix is ever allocated)
+def spectral_layout(n, i1, i2, iterations = 200, seed = 0):
+    if n < 3:
+        return np.random.RandomState(seed).rand(n, 2)
+    rows = np.concatenate([i1, i2])
+    cols = np.concatenate([i2, i1])
+    scale = 1.0 / np.sqrt(np.bincount(rows, minlength = n) + 1.0)
+    trivial = 1.0 / scale
+    trivial /= np.linalg.norm(trivial)
+    x = np.random.RandomState(seed).rand(n, 2)
+    for i in range(iterations):
+        y = x * scale[:, None]
+        y = np.stack([np.bincount(rows, weights = y[cols, d], minlength = n) for d in range(2)], axis = 1) + y
+        x = (x + y * scale[:, None]) / 2
+        x -= np.outer(trivial, trivial.dot(x))
+        x = np.linalg.qr(x)[0]
+    return x
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description = 'Generate visualization from graph file (26 Jun 2016)', add_help = False, usage = 'graph2plot.py [options]')
-    parser.add_argument('-t', metavar = '<CHAR>', type = str, default = 'tab', help = 'separator [tab]')
-    parser.add_argument('-n', action = 'store_true', default = False, help = 'whether to omit node names [False]')
-    parser.add_argument('-l', action = 'store_true', default = False, help = 'whether to use ids rather than labels [False]')
-    parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to remove HapMap/Mendel/Fisher 23andMe individuals [False]')
-    parser.add_argument('-c', action = 'store_true', default = False, help = 'whether to convert special characters to _ [False]')
-    parser.add_argument('-r', metavar = '<IID>', nargs = '+', type = str, help = 'list of individuals to remove')
-    parser.add_argument('-R', metavar = '<FILE>', type = str, help = 'file with individuals to remove')
-    parser.add_argument('-cm', metavar = '<FLOAT>', type = float, help = 'minimum number of centiMorgans')
-    parser.add_argument('-anc', metavar = '<FILE>', type = str, help = 'AncestryDNA matches file')
-    parser.add_argument('-rel', metavar = '<FILE>', type = str, help = '23andMe matches file')
-    parser.add_argument('-f', metavar = '<IID>', nargs = '+', type = str, help = 'list of father proxies')
-    parser.add_argument('-F', metavar = '<FILE>', type = str, help = 'matches file for the father')
-    parser.add_argument('-m', metavar = '<IID>', nargs = '+', type = str, help = 'list of mother proxies')
-    parser.add_argument('-M', metavar = '<FILE>', type = str, help = 'matches file for the mother')
-    parser.add_argument('-s', metavar = '<FLOAT>', nargs = 2, type = float, default = [8.0, 6.0], help = 'size in inches [8.0 6.0]')
-    parser.add_argument('-o', metavar = '<FILE>', type = str, help = 'output pdf file')
-    try:
-        # parser.add_argument('-i', metavar = '[FILE]', type = argparse.FileType('r', encoding = 'UTF-8'), default = sys.stdin, help = 'sharing table [stdin]')
-        parser.add_argument('-i', metavar = '<FILE>', default = sys.stdin, help = 'input graph file [stdin]')
-    except TypeError:
-        sys.stderr.write('Python >= 3.4 is required to run this script\n')
-        sys.stderr.write('(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n')
-        exit(2)
+# Fruchterman-Reingold layout with repulsive forces approximated by the centres of mass of a grid of cells
+# (a single level Barnes-Hut approximation that costs O(n * grid^2) per iteration instead of O(n^2))
+def fr_layout(n, i1, i2, iterations = 100, grid = 32, block = 1024):
+    x = spectral_layout(n, i1, i2)
+    pos = (x - x.min(0)) / np.maximum(x.max(0) - x.min(0), 1e-9) + np.random.RandomState(0).rand(n, 2) * 1e-3
+    k = np.sqrt(1.0 / max(n, 1))
+    for i in range(iterations):
+        temperature = 0.1 * (1 - float(i) / iterations)
+        low = pos.min(0)
+        span = (pos.max(0) - low).max() + 1e-9
+        cell = np.minimum(((pos - low) / span * grid).astype(int), grid - 1)
+        cid = cell[:, 0] * grid + cell[:, 1]
+        occupied = np.unique(cid)
+        mass = np.bincount(cid, minlength = grid * grid)[occupied].astype(float)
+        total = np.stack([np.bincount(cid, weights = pos[:, d], minlength = grid * grid)[occupied] for d in range(2)], axis = 1)
+        disp = np.zeros((n, 2))
+        for start in range(0, n, block):
+            p = pos[start:start + block]
+            own = occupied[None, :] == cid[start:start + block, None]
+            m = mass[None, :] - own
+            centre = (total[None, :, :] - own[:, :, None] * p[:, None, :]) / np.maximum(m, 1)[:, :, None]
+            delta = p[:, None, :] - centre
+            dist2 = np.maximum((delta ** 2).sum(2), 1e-6)
+            disp[start:start + block] = (delta * (m * k * k / dist2)[:, :, None]).sum(1)
+        delta = pos[i1] - pos[i2]
+        force = delta * (np.sqrt((delta ** 2).sum(1)) / k)[:, None]
+        np.add.at(disp, i1, -force)
+        np.add.at(disp, i2, force)
+        length = np.maximum(np.sqrt((disp ** 2).sum(1)), 1e-9)
+        pos += disp / length[:, None] * np.minimum(length, temperature)[:, None]
+    return pos
 
-    # extract arguments from the command line
-    try:
-        parser.error = parser.exit
-        args = parser.parse_args()
-    except SystemExit:
-        parser.print_help()
-        exit(2)
+# this function returns the individuals within a given number of hops from a list of proxies
+# (each hop is a single vectorized pass over the edge list so the cost is linear in the number of edges)
+def get_proxies(p1, p2, proxies, hops = 1):
+    iids, idx = np.unique(np.concatenate([p1, p2]).astype(str), return_inverse = True)
+    i1, i2 = idx[:len(p1)], idx[len(p1):]
+    reached = np.isin(iids, list(proxies))
+    frontier = reached.copy()
+    for hop in range(hops):
+        new = np.zeros(len(iids), dtype = bool)
+        new[i2[frontier[i1]]] = True
+        new[i1[frontier[i2]]] = True
+        frontier = new & ~reached
+        if not frontier.any():
+            break
+        reached |= frontier
+    return set(proxies) | set(iids[reached])
+
+# positions are cached in a file named after the hash of the layout method and of the graph structure
+# (so that they are reused when only the styling options change)
+def get_layout(G, layout, cache = None):
+    # node labels can mix strings and numbers (e.g. missing labels read as NaN) so they are compared as strings
+    nodes = sorted(G.nodes(), key = str)
+    if cache:
+        edges = sorted(sorted([str(u), str(v)]) for u, v in G.edges())
+        file = os.path.join(cache, hashlib.sha1(json.dumps([layout, [str(node) for node in nodes], edges]).encode('utf-8')).hexdigest() + '.json')
+        if os.path.isfile(file):
+            with open(file) as f:
+                return dict((node, tuple(xy)) for node, xy in zip(nodes, json.load(f)))
+
+    if layout == 'dot':
+        import networkx as nx
+        pos = nx.nx_pydot.pydot_layout(G)
+    else:
+        index = dict((node, i) for i, node in enumerate(nodes))
+        i1 = np.array([index[u] for u, v in G.edges()], dtype = int)
+        i2 = np.array([index[v] for u, v in G.edges()], dtype = int)
+        xy = fr_layout(len(nodes), i1, i2) if layout == 'fr' else spectral_layout(len(nodes), i1, i2)
+        pos = dict((node, (float(xy[i, 0]), float(xy[i, 1]))) for i, node in enumerate(nodes))
+
+    if cache:
+        if not os.path.isdir(cache):
+            os.makedirs(cache)
+        with open(file, 'w') as f:
+            json.dump([list(pos[node]) for node in nodes], f)
+    return pos
+
+# pdf files are written through PdfPages while any other format (e.g. png) is chosen by matplotlib from the file extension
+# (the resolution applies to png files and to the rasterized layers of pdf files)
+def save_plot(fig, file, dpi):
+    if file.lower().endswith('.pdf'):
+        from matplotlib.backends.backend_pdf import PdfPages
+        pp = PdfPages(file)
+        pp.savefig(fig, dpi = dpi)
+        pp.close()
+    else:
+        fig.savefig(file, dpi = dpi)
+
+# this function writes a pyramid of size x size png tiles as <dir>/<level>/<x>/<y>.png
+# (the whole plot fits in one tile at level 0 and the resolution doubles at each level)
+def save_tiles(fig, dir, levels, size = 256):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    dpi = fig.get_dpi()
+    canvas = FigureCanvasAgg(fig)
+    for level in range(levels):
+        fig.set_dpi(float(size) / max(fig.get_size_inches()) * 2 ** level)
+        buf, (width, height) = canvas.print_to_buffer()
+        img = np.zeros((-(-height // size) * size, -(-width // size) * size, 4), dtype = np.uint8)
+        img[:height, :width] = np.frombuffer(buf, dtype = np.uint8).reshape(height, width, 4)
+        for x in range(img.shape[1] // size):
+            path = os.path.join(dir, str(level), str(x))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for y in range(img.shape[0] // size):
+                plt.imsave(os.path.join(path, str(y) + '.png'), img[y * size:(y + 1) * size, x * size:(x + 1) * size])
+    fig.set_dpi(dpi)
 
+# this function reads a graph file and draws it either to a file or to the screen
+# (pyplot is imported here rather than at the top so that the backend can be chosen first)
+def plot(args):
+    import matplotlib.pyplot as plt, networkx as nx
     remove = set()
     if args.r:
         remove |= set(args.r)
@@ -75,12 +165,15 @@ if __name__ == '__main__':
 
     # shapes = 'so^>v<dph8'
 
+    # a missing side, as for matches whose shared matches were not downloaded, counts as not on that side
+    owner = set()
     if args.anc:
         df = pd.read_csv(args.anc, sep = '\t')
-        meiosis = pd.Series(df['meiosisValue'].values, index = df['testGuid']).to_dict()
-        hint = pd.Series(df['hasHint'].values, index = df['testGuid']).to_dict()
-        patside = pd.Series(df['patside'].values, index = df['testGuid']).to_dict() if 'patside' in df else pd.Series(False, index = df['testGuid']).to_dict()
-        matside = pd.Series(df['matside'].values, index = df['testGuid']).to_dict() if 'matside' in df else pd.Series(False, index = df['testGuid']).to_dict()
+        owner = set(df.loc[df['meiosisValue'] == 0, 'testGuid'])
+        meiosis = dict(zip(df['testGuid'], df['meiosisValue']))
+        hint = dict(zip(df['testGuid'], df['hasHint']))
+        patside = dict(zip(df['testGuid'], df['patside'].fillna(False).astype(bool))) if 'patside' in df else dict.fromkeys(df['testGuid'], False)
+        matside = dict(zip(df['testGuid'], df['matside'].fillna(False).astype(bool))) if 'matside' in df else dict.fromkeys(df['testGuid'], False)
         if args.F:
             df = pd.read_csv(args.F, sep = '\t')
             for guid in set(df['testGuid']).intersection(patside):
@@ -93,10 +186,10 @@ if __name__ == '__main__':
     if args.rel:
         df = pd.read_csv(args.rel, sep = '\t')
         # gender = pd.Series(df['sex'].apply(str.lower).values, index = df['ehid']).to_dict()
-        meiosis = pd.Series(df['rel_alg'].apply(lambda x: int(round(x/4.0))).values, index = df['ehid']).to_dict()
-        hint = pd.Series(False, index = df['ehid']).to_dict()
-        patside = pd.Series(df['patside'].values, index = df['ehid']).to_dict()
-        matside = pd.Series(df['matside'].values, index = df['ehid']).to_dict()
+        meiosis = dict(zip(df['ehid'], df['rel_alg'].apply(lambda x: int(round(x/4.0)))))
+        hint = dict.fromkeys(df['ehid'], False)
+        patside = dict(zip(df['ehid'], df['patside'].fillna(False).astype(bool)))
+        matside = dict(zip(df['ehid'], df['matside'].fillna(False).astype(bool)))
         if args.F:
             df = pd.read_csv(args.F, sep = '\t')
             for ehid in set(df['ehid']).intersection(patside):
@@ -106,49 +199,54 @@ if __name__ == '__main__':
             for ehid in set(df['ehid']).intersection(matside):
                 matside[ehid] = True
 
-    df = pd.read_csv(args.i, sep = '\t' if args.t == 'tab' else args.t)
+    # the graph file can be processed in chunks so that only the graph is kept in memory
+    # (node attributes other than gender are assigned once all edges have been read)
+    dtype = { 'p1': str, 'p2': str, 'l1': 'category', 'l2': 'category', 'g1': 'category', 'g2': 'category', 'mb': float, 'cm': float }
+    chunks = pd.read_csv(args.i, sep = '\t' if args.t == 'tab' else args.t, dtype = dtype, chunksize = args.z) if args.z else [pd.read_csv(args.i, sep = '\t' if args.t == 'tab' else args.t, dtype = dtype)]
     p1 = 'p1' if args.l else 'l1'
     p2 = 'p2' if args.l else 'l2'
-    if args.v:
-        idx = df['p1'].apply(lambda x: x[0:2]!='v$') & df['p2'].apply(lambda x: x[0:2]!='v$')
-        df = df.loc[idx]
-    if args.c:
-        df['l1'] = df['l1'].apply(lambda x: re.sub('[ .]','_',x))
-        df['l2'] = df['l2'].apply(lambda x: re.sub('[ .]','_',x))
+    G = nx.Graph()
+    edges = list()
+    for df in chunks:
+        if args.v:
+            idx = ~df['p1'].str.startswith('v$') & ~df['p2'].str.startswith('v$')
+            df = df.loc[idx].copy()
+        if args.c:
+            df['l1'] = df['l1'].apply(lambda x: re.sub('[ .]','_',x))
+            df['l2'] = df['l2'].apply(lambda x: re.sub('[ .]','_',x))
 
-    if args.anc or args.rel:
-        if args.f:
-            for iid in [iid for iid in args.f if iid in patside]:
-                patside[iid] = True
-            for iid in [df.loc[i,'p1'] for i in df.index if df.loc[i,'p2'] in args.f if df.loc[i,'p1'] in patside]:
-                patside[iid] = True
-            for iid in [df.loc[i,'p2'] for i in df.index if df.loc[i,'p1'] in args.f if df.loc[i,'p2'] in patside]:
-                patside[iid] = True
-        if args.m:
-            for iid in [iid for iid in args.m if iid in matside]:
-                matside[iid] = True
-            for iid in [df.loc[i,'p1'] for i in df.index if df.loc[i,'p2'] in args.m if df.loc[i,'p1'] in matside]:
-                matside[iid] = True
-            for iid in [df.loc[i,'p2'] for i in df.index if df.loc[i,'p1'] in args.m if df.loc[i,'p2'] in matside]:
-                matside[iid] = True
+        # only edges that are drawn are used to find the relatives of the proxies
+        # (except those of the test owner as through it every match would be within two hops of the proxies)
+        idx = ~df['p1'].isin(remove) & ~df['p2'].isin(remove)
+        if args.rel:
+            idx &= df['p1'].isin(set(meiosis)) & df['p2'].isin(set(meiosis))
+        if 'cm' in df and args.cm:
+            idx &= df['cm'].isnull() | (df['cm'] > args.cm)
+        if (args.anc or args.rel) and (args.f or args.m):
+            proxy = idx & ~df['p1'].isin(owner) & ~df['p2'].isin(owner)
+            edges.append((df.loc[proxy, 'p1'].values, df.loc[proxy, 'p2'].values))
 
-    G = nx.Graph()
-    for i in df.index:
-        if df['p1'][i] in remove or df['p2'][i] in remove or args.rel and not (df['p1'][i] in meiosis and df['p2'][i] in meiosis):
-            continue
-        if not 'cm' in df or pd.isnull(df['cm'][i]) or not args.cm or df['cm'][i] > args.cm:
-            if args.anc or args.rel:
-                G.add_node(df[p1][i], gender = df['g1'][i].lower(), meiosis = meiosis[df['p1'][i]], hint = hint[df['p1'][i]], patside = patside[df['p1'][i]], matside = matside[df['p1'][i]])
-                G.add_node(df[p2][i], gender = df['g2'][i].lower(), meiosis = meiosis[df['p2'][i]], hint = hint[df['p2'][i]], patside = patside[df['p2'][i]], matside = matside[df['p2'][i]])
-            else:
-                G.add_node(df[p1][i], gender = df['g1'][i].lower())
-                G.add_node(df[p2][i], gender = df['g2'][i].lower())
+        for i in df.index[idx.values]:
+            G.add_node(df[p1][i], iid = df['p1'][i], gender = df['g1'][i].lower())
+            G.add_node(df[p2][i], iid = df['p2'][i], gender = df['g2'][i].lower())
             G.add_edge(df[p1][i], df[p2][i])
 
+    # proxies and the individuals they share DNA with, directly or through up to -H hops, are assigned to their side
+    if (args.anc or args.rel) and (args.f or args.m):
+        iid1, iid2 = (np.concatenate(x) for x in zip(*edges)) if edges else (np.array([], dtype = str), np.array([], dtype = str))
+        for proxies, side in (args.f, patside), (args.m, matside):
+            if proxies:
+                for iid in get_proxies(iid1, iid2, proxies, args.H).intersection(side):
+                    side[iid] = True
+
+    if args.anc or args.rel:
+        for node, value in G.nodes(data = True):
+            iid = value['iid']
+            value.update(meiosis = meiosis[iid], hint = hint[iid], patside = patside[iid], matside = matside[iid])
+
     if args.o:
-        pp = PdfPages(args.o)
         plt.figure(figsize = (args.s[0], args.s[1]))
-    pos = nx.pydot_layout(G)
+    pos = get_layout(G, args.L, args.P)
 
     colors = {(False, False, False): 'white',      (False, False, True): 'gray',
               (False, True,  False): 'pink',       (False, True,  True): 'deeppink',
@@ -157,26 +255,105 @@ if __name__ == '__main__':
 
     shapes = {'male': 's', 'female': 'o', 'unknown': 'd'}
 
-    if args.anc or args.rel:
-        sizes = [size for size in [2048, 1536, 1024, 768, 512, 384, 256, 192, 128, 32, 32]]
-        for gender in 'male', 'female', 'unknown':
-            for meiosis in set([value['meiosis'] for key, value in G.node.items()]):
-                for patside in True, False:
-                    for matside in True, False:
-                        for hint in True, False:
-                            nodelist = [key for (key, value) in G.node.items() if value['gender'] == gender and value['meiosis'] == meiosis and value['hint'] == hint and value['patside'] == patside and value['matside'] == matside]
-                            nx.draw_networkx_nodes(G, pos, nodelist = nodelist, node_color = colors[(patside, matside, hint)], node_shape = shapes[gender], node_size = sizes[meiosis - 1], alpha = 1)
-    else:
-        for gender in 'male', 'female', 'unknown':
-            nodelist = [key for (key, value) in G.node.items() if value['gender'] == gender]
-            nx.draw_networkx_nodes(G, pos, nodelist = nodelist, node_color = 'white', node_shape = shapes[gender], node_size = 100, alpha = .5)
-    nx.draw_networkx_edges(G, pos, edge_color = 'gray', alpha = .25)
+    # node colors and sizes are computed once and each shape is drawn with a single scatter call
+    # (larger nodes are drawn first so that closer relatives do not hide more distant ones)
+    collections = list()
+    sizes = [2048, 1536, 1024, 768, 512, 384, 256, 192, 128, 32, 32]
+    for gender in 'male', 'female', 'unknown':
+        if args.anc or args.rel:
+            nodes = [(sizes[value['meiosis'] - 1], colors[(value['patside'], value['matside'], value['hint'])], key) for key, value in G.nodes(data = True)
+                     if value['gender'] == gender and (value['patside'], value['matside'], value['hint']) in colors]
+            nodes.sort(key = lambda x: -x[0])
+            collections.append(nx.draw_networkx_nodes(G, pos, nodelist = [x[2] for x in nodes], node_color = [x[1] for x in nodes], node_shape = shapes[gender], node_size = [x[0] for x in nodes], alpha = 1))
+        else:
+            nodelist = [key for key, value in G.nodes(data = True) if value['gender'] == gender]
+            collections.append(nx.draw_networkx_nodes(G, pos, nodelist = nodelist, node_color = 'white', node_shape = shapes[gender], node_size = 100, alpha = .5))
+    # all edges are drawn as a single LineCollection
+    collections.append(nx.draw_networkx_edges(G, pos, edge_color = 'gray', alpha = .25))
+    for collection in collections:
+        if collection is not None:
+            collection.set_rasterized(args.x)
     if not args.n:
         nx.draw_networkx_labels(G, pos, font_size = 8)
 
     plt.axis('off')
     if args.o:
-        pp.savefig()
-        pp.close()
+        save_plot(plt.gcf(), args.o, args.dpi)
+        if args.T:
+            save_tiles(plt.gcf(), os.path.splitext(args.o)[0] + '.tiles', args.T)
     else:
         plt.show()
+    plt.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate visualization from graph file (26 Jun 2016)', add_help = False, usage = 'graph2plot.py [options]')
+    parser.add_argument('-t', metavar = '<CHAR>', type = str, default = 'tab', help = 'separator [tab]')
+    parser.add_argument('-n', action = 'store_true', default = False, help = 'whether to omit node names [False]')
+    parser.add_argument('-l', action = 'store_true', default = False, help = 'whether to use ids rather than labels [False]')
+    parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to remove HapMap/Mendel/Fisher 23andMe individuals [False]')
+    parser.add_argument('-c', action = 'store_true', default = False, help = 'whether to convert special characters to _ [False]')
+    parser.add_argument('-r', metavar = '<IID>', nargs = '+', type = str, help = 'list of individuals to remove')
+    parser.add_argument('-R', metavar = '<FILE>', type = str, help = 'file with individuals to remove')
+    parser.add_argument('-cm', metavar = '<FLOAT>', type = float, help = 'minimum number of centiMorgans')
+    parser.add_argument('-anc', metavar = '<FILE>', type = str, help = 'AncestryDNA matches file')
+    parser.add_argument('-rel', metavar = '<FILE>', type = str, help = '23andMe matches file')
+    parser.add_argument('-f', metavar = '<IID>', nargs = '+', type = str, help = 'list of father proxies')
+    parser.add_argument('-F', metavar = '<FILE>', type = str, help = 'matches file for the father')
+    parser.add_argument('-m', metavar = '<IID>', nargs = '+', type = str, help = 'list of mother proxies')
+    parser.add_argument('-M', metavar = '<FILE>', type = str, help = 'matches file for the mother')
+    parser.add_argument('-H', metavar = '<INT>', type = int, default = 1, help = 'number of hops over which to propagate father and mother proxies [1]')
+    parser.add_argument('-z', metavar = '<INT>', type = int, help = 'number of lines to process at a time [all]')
+    parser.add_argument('-L', metavar = '<STR>', type = str, default = 'dot', choices = ['dot', 'fr', 'spectral'], help = 'layout (dot through pydot, fr for force-directed or spectral) [dot]')
+    parser.add_argument('-P', metavar = '<DIR>', type = str, help = 'directory where to cache node positions')
+    parser.add_argument('-s', metavar = '<FLOAT>', nargs = 2, type = float, default = [8.0, 6.0], help = 'size in inches [8.0 6.0]')
+    parser.add_argument('-x', action = 'store_true', default = False, help = 'whether to rasterize nodes and edges in pdf output [False]')
+    parser.add_argument('-dpi', metavar = '<INT>', type = int, default = 300, help = 'resolution of png output and of rasterized layers [300]')
+    parser.add_argument('-T', metavar = '<INT>', type = int, default = 0, help = 'number of zoom levels of png tiles to write in a directory next to the output file [0]')
+    parser.add_argument('-o', metavar = '<FILE>', type = str, help = 'output pdf or png file')
+    parser.add_argument('-batch', metavar = '<FILE>', type = str, help = 'file with the options of one plot per line to render within a single process')
+    try:
+        # parser.add_argument('-i', metavar = '[FILE]', type = argparse.FileType('r', encoding = 'UTF-8'), default = sys.stdin, help = 'sharing table [stdin]')
+        parser.add_argument('-i', metavar = '<FILE>', default = sys.stdin, help = 'input graph file [stdin]')
+    except TypeError:
+        sys.stderr.write('Python >= 3.4 is required to run this script\n')
+        sys.stderr.write('(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n')
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    if args.T and not args.o:
+        sys.stderr.write('Writing tiles requires an output file\n')
+        exit(2)
+
+    # the Agg backend is selected before pyplot is imported so that no display is needed when writing to files
+    if args.o or args.batch:
+        matplotlib.use('Agg')
+
+    # networkx is only looked for here as it is imported by plot() after the backend has been selected
+    if importlib.util.find_spec('networkx') is None:
+        sys.stderr.write('You need to install the networkx module first\n')
+        sys.stderr.write('(run this in your terminal: "python -m pip install networkx" or "python -m pip install --user networkx")\n')
+        exit(2)
+
+    # each line of the batch file is parsed with the options from the command line as defaults
+    if args.batch:
+        with open(args.batch) as f:
+            lines = [line for line in f if line.strip() and not line.startswith('#')]
+        for i, line in enumerate(lines):
+            try:
+                plot_args = parser.parse_args(shlex.split(line), copy.copy(args))
+            except SystemExit:
+                sys.stderr.write('Warning: could not parse line ' + str(i + 1) + ' of the batch file\n')
+                continue
+            if not plot_args.o:
+                sys.stderr.write('Warning: line ' + str(i + 1) + ' of the batch file has no output file\n')
+                continue
+            plot(plot_args)
+    else:
+        plot(args)
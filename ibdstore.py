@@ -0,0 +1,69 @@
+"""
+   ibdstore.py - Columnar storage of 23andMe IBD segments
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import json, zipfile, numpy as np
+
+# a store is a dictionary of arrays with one entry per pair (p1, p2) and one entry per segment (pair, chrom, half, start, end)
+# (chrom is an index into chroms and half is 0 for half identical and 1 for fully identical segments)
+CHROMS = [str(i) for i in range(1, 23)] + ['X', 'Y']
+
+# this function converts the JSON intervals column of an ibdview table into a store
+def intervals_to_segments(p1, p2, intervals):
+    code = { chrom: i for i, chrom in enumerate(CHROMS) }
+    pair, chrom, half, pos = [], [], [], []
+    for i, value in enumerate(intervals):
+        for key, halves in json.loads(value).items():
+            for h, segs in enumerate(halves):
+                for seg in segs:
+                    pair.append(i)
+                    chrom.append(code[key])
+                    half.append(h)
+                    pos.append(seg)
+    pos = np.array(pos, dtype = np.int64).reshape(-1, 2)
+    return { 'p1': np.array(list(p1), dtype = str), 'p2': np.array(list(p2), dtype = str), 'chroms': np.array(CHROMS),
+             'pair': np.array(pair, dtype = np.int32), 'chrom': np.array(chrom, dtype = np.int8), 'half': np.array(half, dtype = np.int8),
+             'start': pos[:, 0], 'end': pos[:, 1] }
+
+# the store is saved uncompressed so that load_segments can memory-map each array in place
+def save_segments(file, store):
+    np.savez(file, **store)
+
+# this function memory-maps each array of a store saved with save_segments
+# (compressed members, if any, are read into memory instead)
+def load_segments(file):
+    store = dict()
+    with zipfile.ZipFile(file) as z, open(file, 'rb') as f:
+        for info in z.infolist():
+            name = info.filename[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with z.open(info) as g:
+                    store[name] = np.lib.format.read_array(g)
+                continue
+            # skip the local file header to reach the .npy data
+            f.seek(info.header_offset)
+            header = f.read(30)
+            f.seek(info.header_offset + 30 + int.from_bytes(header[26:28], 'little') + int.from_bytes(header[28:30], 'little'))
+            version = np.lib.format.read_magic(f)
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f) if version == (1, 0) else np.lib.format.read_array_header_2_0(f)
+            if np.prod(shape) == 0:
+                store[name] = np.empty(shape, dtype = dtype)
+            else:
+                store[name] = np.memmap(file, dtype = dtype, mode = 'r', offset = f.tell(), shape = shape, order = 'F' if fortran else 'C')
+    return store
@@ -19,30 +19,74 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, pandas as pd, json, numpy as np
+import sys, argparse, os, hashlib, tempfile, pandas as pd, numpy as np, ibdstore
+
+# the parsed genetic map is cached as memory-mapped numpy arrays in a directory named after the checksum of the map files
+# (a change to any of the map files yields a new checksum and therefore a new cache)
+def load_genetic_map(chroms, files, cache = None):
+    if cache:
+        md5 = hashlib.md5()
+        for chrom, file in zip(chroms, files):
+            md5.update(chrom.encode('UTF-8'))
+            with open(file, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(block)
+        path = os.path.join(cache, md5.hexdigest())
+        if os.path.isdir(path):
+            return { chrom: { col: np.load(os.path.join(path, chrom + '.' + col + '.npy'), mmap_mode = 'r') for col in ['BP', 'CM'] } for chrom in chroms }
 
-def load_genetic_map(chroms, files):
     gmap = dict()
     for chrom, file in zip(chroms, files):
-        df = pd.read_csv(file, delim_whitespace = True, names = ['CHR', 'ID' ,'CM', 'BP'])
-        gmap[chrom] = df[['BP', 'CM']]
+        df = pd.read_csv(file, sep = r'\s+', names = ['CHR', 'ID' ,'CM', 'BP'])
+        gmap[chrom] = { 'BP': df['BP'].values, 'CM': df['CM'].values }
+
+    if cache:
+        # write to a temporary directory first so that concurrent processes never see a partial cache
+        os.makedirs(cache, exist_ok = True)
+        tmp = tempfile.mkdtemp(dir = cache)
+        for chrom in chroms:
+            for col in ['BP', 'CM']:
+                np.save(os.path.join(tmp, chrom + '.' + col + '.npy'), gmap[chrom][col])
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            for file in os.listdir(tmp):
+                os.remove(os.path.join(tmp, file))
+            os.rmdir(tmp)
     return gmap
 
-def get_mb(intervals, flag):
-    correction = sum([np.diff(seg)[0] for seg in intervals['X'][0]]) / 2e6 if flag else 0
-    return sum([np.diff(seg)[0] for (key, value) in intervals.items() for seg in value[0]]) / 1e6 - correction
+# this function selects the half identical segments of the selected pairs in a store
+# (pairs are renumbered so that they match the rows of the filtered table)
+def get_segments(store, idx):
+    pair = np.cumsum(idx) - 1
+    seg = (store['half'] == 0) & idx[store['pair']]
+    return { 'pair': pair[store['pair'][seg]], 'chrom': store['chroms'][store['chrom'][seg]], 'pos': np.stack([store['start'][seg], store['end'][seg]], axis = 1).astype(float) }
+
+# lengths are summed per pair with a single bincount and half of the X chromosome is removed for male pairs
+def sum_by_pair(segs, length, n, flags):
+    x = segs['chrom'] == 'X'
+    correction = np.bincount(segs['pair'][x], weights = length[x], minlength = n) / 2
+    return np.bincount(segs['pair'], weights = length, minlength = n) - flags * correction
+
+def get_mb(segs, n, flags):
+    return sum_by_pair(segs, np.diff(segs['pos'], axis = 1)[:, 0] / 1e6, n, flags)
 
 # wget http://bochet.gcc.biostat.washington.edu/beagle/genetic_maps/plink.GRCh37.map.zip
-def get_cm(intervals, gmap, flag):
-    correction = sum([np.diff(np.interp(seg, gmap['X']['BP'], gmap['X']['CM']))[0] for seg in intervals['X'][0]]) / 2 if flag else 0
-    return sum([np.diff(np.interp(seg, gmap[key]['BP'], gmap[key]['CM']))[0] for (key, value) in intervals.items() for seg in value[0]]) - correction
+def get_cm(segs, n, gmap, flags):
+    length = np.empty(len(segs['pair']))
+    for chrom in np.unique(segs['chrom']):
+        idx = segs['chrom'] == chrom
+        length[idx] = np.diff(np.interp(segs['pos'][idx], gmap[chrom]['BP'], gmap[chrom]['CM']), axis = 1)[:, 0]
+    return sum_by_pair(segs, length, n, flags)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Process 23andMe IBD sharing data dump (26 Jun 2016)', add_help = False, usage = 'ibd2graph.py -h <inheritance> -i <ibdview> [options]')
     parser.add_argument('-h', metavar = '<FILE>', required = True, type = str, help = 'input inheritance table file')
-    parser.add_argument('-i', metavar = '<FILE>', required = True, type = str, help = 'input ibdview table file')
+    parser.add_argument('-i', metavar = '<FILE>', required = True, type = str, help = 'input ibdview table file (or binary segment store ending in .npz)')
     parser.add_argument('-c', metavar = '<STR>', nargs = '+', type = str, help = 'genetic map chromosomes')
     parser.add_argument('-g', metavar = '<STR>', nargs = '+', type = str, help = 'genetic map files')
+    parser.add_argument('-z', metavar = '<INT>', type = int, help = 'number of lines to process at a time [all]')
+    parser.add_argument('-k', metavar = '<DIR>', type = str, help = 'directory where to cache the genetic map in binary format')
     try:
         parser.add_argument('-o', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stdout, help = 'output graph file [stdout]')
     except TypeError:
@@ -59,23 +103,31 @@ if __name__ == '__main__':
         exit(2)
 
     if args.c and args.g:
-        gmap = load_genetic_map(args.c, args.g)
+        gmap = load_genetic_map(args.c, args.g, args.k)
     df = pd.read_csv(args.h, sep = '\t')
     ehid_label = dict(zip(df['people_ids'], df['people_labels']))
     ehid_gender = dict(zip(df['people_ids'], df['gender']))
-    df = pd.read_csv(args.i, sep = '\t')
-    idx = df['p1'].apply(lambda x: x in ehid_label) & df['p2'].apply(lambda x: x in ehid_label)
-    df = df.loc[idx]
-    for i in df.index:
-        p1 = df['p1'][i]
-        p2 = df['p2'][i]
-        intervals = json.loads(df['intervals'][i])
-        df.set_value(i, 'l1', ehid_label[p1])
-        df.set_value(i, 'l2', ehid_label[p2])
-        df.set_value(i, 'g1', ehid_gender[p1])
-        df.set_value(i, 'g2', ehid_gender[p2])
-        flag = ehid_gender[p1] == 'Male' and ehid_gender[p2] == 'Male'
-        df.set_value(i, 'mb', get_mb(intervals, flag))
+
+    # the ibdview table can be processed in chunks with each chunk written to the output as soon as it is done
+    # (a binary segment store written by getmy23andme.py is memory-mapped and processed in one go)
+    if args.i.endswith('.npz'):
+        store = ibdstore.load_segments(args.i)
+        chunks = [(pd.DataFrame({ 'p1': store['p1'], 'p2': store['p2'] }), store)]
+    else:
+        chunks = pd.read_csv(args.i, sep = '\t', usecols = ['p1', 'p2', 'intervals'], dtype = str, chunksize = args.z) if args.z else [pd.read_csv(args.i, sep = '\t', usecols = ['p1', 'p2', 'intervals'], dtype = str)]
+        chunks = ((df, ibdstore.intervals_to_segments(df['p1'], df['p2'], df['intervals'])) for df in chunks)
+    header = True
+    for df, store in chunks:
+        idx = (df['p1'].isin(set(ehid_label)) & df['p2'].isin(set(ehid_label))).values
+        segs = get_segments(store, idx)
+        df = df.loc[idx, ['p1', 'p2']].copy()
+        df['l1'] = df['p1'].map(ehid_label)
+        df['l2'] = df['p2'].map(ehid_label)
+        df['g1'] = df['p1'].map(ehid_gender)
+        df['g2'] = df['p2'].map(ehid_gender)
+        flags = ((df['g1'] == 'Male') & (df['g2'] == 'Male')).values
+        df['mb'] = get_mb(segs, len(df), flags)
         if args.c and args.g:
-            df.set_value(i, 'cm', get_cm(intervals, gmap, flag))
-    df.to_csv(args.o, sep = '\t', columns = ['p1','l1','g1','p2','l2','g2','mb'] + ['cm'] if args.c and args.g else [], index = False)
+            df['cm'] = get_cm(segs, len(df), gmap, flags)
+        df.to_csv(args.o, sep = '\t', columns = ['p1','l1','g1','p2','l2','g2','mb'] + (['cm'] if args.c and args.g else []), index = False, header = header)
+        header = False
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+   ibdview2triangulation.py - Find groups of overlapping 23andMe IBD segments
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, argparse, array, pandas as pd, numpy as np, ibdstore
+
+# this function yields the groups of segments that all overlap a common region, that is the maximal cliques of the overlap graph
+# (a sweep over the sorted starts and ends emits a group whenever a segment ends right after other segments started so that
+# two segments that do not overlap are never grouped together only because both overlap a third one)
+# (chromosome and position are combined in one key so that a group never spans two chromosomes)
+# (the individuals of the active segments are counted as the sweep goes so that only groups with at least n individuals are
+# materialized, and each group is yielded as it closes as its region, its number of individuals and its segments)
+def get_groups(chrom, start, end, p1, p2, n = 1, chunk = 65536):
+    m = len(chrom)
+    offset = chrom.astype(np.int64) << 32
+    pos = np.concatenate([offset + start, offset + end])
+    # segments are half open so at the same position ends come before starts
+    is_start = np.concatenate([np.ones(m, dtype = bool), np.zeros(m, dtype = bool)])
+    order = np.lexsort((is_start, pos))
+    active = set()
+    count = dict()
+    opened = False
+    # events are converted to python objects one chunk at a time
+    for k in range(0, 2 * m, chunk):
+        seg = order[k:k + chunk] % m
+        for i, p, s, x, y in zip(seg.tolist(), pos[order[k:k + chunk]].tolist(), is_start[order[k:k + chunk]].tolist(), p1[seg].tolist(), p2[seg].tolist()):
+            if s:
+                active.add(i)
+                count[x] = count.get(x, 0) + 1
+                count[y] = count.get(y, 0) + 1
+                opened = True
+                last = p
+                continue
+            if opened and len(count) >= n:
+                member = np.fromiter(active, dtype = np.int64, count = len(active))
+                yield last & 0xffffffff, p & 0xffffffff, len(count), member[np.lexsort((end[member], start[member]))]
+            opened = False
+            active.discard(i)
+            for z in x, y:
+                if count[z] == 1:
+                    del count[z]
+                else:
+                    count[z] -= 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Find groups of overlapping 23andMe IBD segments (26 Jun 2016)', add_help = False, usage = 'ibdview2triangulation.py -i <ibdview> [options]')
+    parser.add_argument('-h', metavar = '<FILE>', type = str, help = 'input inheritance table file')
+    parser.add_argument('-i', metavar = '<FILE>', required = True, type = str, help = 'input ibdview table file (or binary segment store ending in .npz)')
+    parser.add_argument('-n', metavar = '<INT>', type = int, default = 3, help = 'minimum number of individuals in a group [3]')
+    parser.add_argument('-mb', metavar = '<FLOAT>', type = float, default = 0.0, help = 'minimum segment length in megabases [0.0]')
+    parser.add_argument('-v', action = 'store_true', default = False, help = 'whether to remove HapMap/Mendel/Fisher 23andMe individuals [False]')
+    parser.add_argument('-f', metavar = '<STR>', type = str, help = 'focal individual whose segments are triangulated [all individuals]')
+    parser.add_argument('-b', metavar = '<INT>', type = int, default = 100000, help = 'number of output rows buffered before they are written [100000]')
+    parser.add_argument('-m', metavar = '<FILE>', type = str, help = 'output table with the groups of each individual')
+    try:
+        parser.add_argument('-o', metavar = '<FILE>', type = argparse.FileType('w', encoding = 'UTF-8'), default = sys.stdout, help = 'output segments table [stdout]')
+    except TypeError:
+        sys.stderr.write('Python >= 3.4 is required to run this script\n')
+        sys.stderr.write('(see https://docs.python.org/3/whatsnew/3.4.html#argparse)\n')
+        exit(2)
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    if args.i.endswith('.npz'):
+        store = ibdstore.load_segments(args.i)
+    else:
+        df = pd.read_csv(args.i, sep = '\t', usecols = ['p1', 'p2', 'intervals'], dtype = str)
+        store = ibdstore.intervals_to_segments(df['p1'], df['p2'], df['intervals'])
+    if args.h:
+        df = pd.read_csv(args.h, sep = '\t')
+        ehid_label = dict(zip(df['people_ids'], df['people_labels']))
+    else:
+        ehid_label = dict()
+
+    # select half identical segments of the selected pairs
+    idx = np.ones(len(store['p1']), dtype = bool)
+    if args.h:
+        idx &= pd.Series(store['p1']).isin(set(ehid_label)).values & pd.Series(store['p2']).isin(set(ehid_label)).values
+    if args.v:
+        idx &= ~pd.Series(store['p1']).str.startswith('v$').values & ~pd.Series(store['p2']).str.startswith('v$').values
+    # with a focal individual only its own segments are swept so that overlaps are never deeper than its number of matches
+    if args.f:
+        idx &= (store['p1'] == args.f) | (store['p2'] == args.f)
+    seg = (store['half'] == 0) & idx[store['pair']] & (store['end'] - store['start'] >= args.mb * 1e6)
+    pair = np.asarray(store['pair'][seg])
+    chrom = np.asarray(store['chrom'][seg])
+    start = np.asarray(store['start'][seg])
+    end = np.asarray(store['end'][seg])
+    # individuals are numbered once so that the sweep counts them as integers
+    code, iids = pd.factorize(np.concatenate([store['p1'], store['p2']]))
+    p1, p2 = code[:len(store['p1'])][pair], code[len(store['p1']):][pair]
+
+    # groups of segments sharing a common region among enough individuals are written in chunks as they close
+    # (the groups of each individual are kept as two flat integer arrays)
+    columns = ['cluster', 'n', 'chrom', 'region_start', 'region_end', 'start', 'end', 'p1', 'l1', 'p2', 'l2']
+    buffer, rows, header = [], 0, True
+    member_iid, member_cluster = array.array('q'), array.array('q')
+    def flush(buffer, header):
+        cluster, n, begin, finish, seg = [np.concatenate(x) for x in zip(*buffer)] if buffer else [np.empty(0, dtype = np.int64)] * 5
+        df = pd.DataFrame({ 'cluster': cluster, 'n': n, 'chrom': store['chroms'][chrom[seg]], 'region_start': begin, 'region_end': finish,
+                            'start': start[seg], 'end': end[seg], 'p1': iids[p1[seg]], 'p2': iids[p2[seg]] })
+        df['l1'] = df['p1'].map(ehid_label)
+        df['l2'] = df['p2'].map(ehid_label)
+        df.to_csv(args.o, sep = '\t', columns = columns, header = header, na_rep = 'NA', index = False)
+    for cluster, (begin, finish, n, seg) in enumerate(get_groups(chrom, start, end, p1, p2, args.n)):
+        k = len(seg)
+        buffer.append((np.full(k, cluster), np.full(k, n), np.full(k, begin), np.full(k, finish), seg))
+        rows += k
+        if args.m:
+            iid = np.unique(np.concatenate([p1[seg], p2[seg]]))
+            member_iid.extend(iid.tolist())
+            member_cluster.extend([cluster] * len(iid))
+        if rows >= args.b:
+            flush(buffer, header)
+            buffer, rows, header = [], 0, False
+    if buffer or header:
+        flush(buffer, header)
+
+    if args.m:
+        members = pd.DataFrame({ 'iid': iids[np.frombuffer(member_iid, dtype = np.int64)], 'cluster': np.frombuffer(member_cluster, dtype = np.int64) }).sort_values(['iid', 'cluster'])
+        members = members.groupby('iid', sort = False)['cluster'].apply(lambda x: ','.join(map(str, x))).reset_index()
+        members['label'] = members['iid'].map(ehid_label)
+        members.to_csv(args.m, sep = '\t', columns = ['iid', 'label', 'cluster'], na_rep = 'NA', index = False)
@@ -19,27 +19,13 @@
    Written by Giulio Genovese <giulio.genovese@gmail.com>
 """
 
-import sys, argparse, pandas as pd, numpy as np, matplotlib, matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description = 'Creates a plot of sharing (26 Jun 2016)', add_help = False, usage = 'matches2plot.py -a <table1> -b <table2> [options]')
-    parser.add_argument('-a', metavar = '<FILE>', required = True, type = str, help = 'table1')
-    parser.add_argument('-b', metavar = '<FILE>', required = True, type = str, help = 'table2')
-    parser.add_argument('-l', metavar = '<STR>', type = str, help = 'title')
-    parser.add_argument('-la', metavar = '<STR>', type = str, help = 'label1')
-    parser.add_argument('-lb', metavar = '<STR>', type = str, help = 'label2')
-    parser.add_argument('-fs', metavar = '<INT>', type = int, default = 16, help = 'font size')
-    parser.add_argument('-o', metavar = '<FILE>', type = str, help = 'output pdf file')
-
-    # extract arguments from the command line
-    try:
-        parser.error = parser.exit
-        args = parser.parse_args()
-    except SystemExit:
-        parser.print_help()
-        exit(2)
+import sys, argparse, shlex, copy, pandas as pd, matplotlib
 
+# this function plots the sharing of the matches in common between two tables either to a file or to the screen
+# (pyplot is imported here rather than at the top so that the backend can be chosen first)
+def plot(args):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
     df1 = pd.read_csv(args.a, sep = '\t')
     df2 = pd.read_csv(args.b, sep = '\t')
     if ('ehid' in df1 and 'pct' in df1 and 'ehid' in df2 and 'pct' in df2):
@@ -57,24 +43,26 @@ if __name__ == '__main__':
         maxvalue = 100
         ticks = [5, 10, 20, 50]
     else:
-        exit
+        sys.stderr.write('Error: ' + args.a + ' and ' + args.b + ' are not both AncestryDNA or both 23andMe matches files\n')
+        return
 
     df1 = df1[[iid, share]].dropna().rename(columns = {iid: 'iid', share: 'x'})
     df2 = df2[[iid, share]].dropna().rename(columns = {iid: 'iid', share: 'y'})
-    if df1['x'].dtype == np.object:
+    # percentages are read as strings (object or, with pandas >= 3, str dtype) and need the '%' stripped
+    if not pd.api.types.is_numeric_dtype(df1['x']):
         df1['x'] = df1['x'].replace({'%': ''}, regex = True).astype(float)
+    if not pd.api.types.is_numeric_dtype(df2['y']):
         df2['y'] = df2['y'].replace({'%': ''}, regex = True).astype(float)
     df = df1.merge(df2)
 
     far = abs(df['x'] - df['y']) > min(ticks)
 
     if args.o:
-        pp = PdfPages(args.o)
         plt.figure()
     fig, ax = plt.subplots()
     matplotlib.rcParams.update({'font.size': args.fs})
-    ax.scatter(df.ix[~far, 'x'], df.ix[~far, 'y'], color = 'blue', marker = 'x')
-    ax.scatter(df.ix[far, 'x'], df.ix[far, 'y'], color = 'red', marker = 'x')
+    ax.scatter(df.loc[~far, 'x'], df.loc[~far, 'y'], color = 'blue', marker = 'x', rasterized = args.x)
+    ax.scatter(df.loc[far, 'x'], df.loc[far, 'y'], color = 'red', marker = 'x', rasterized = args.x)
     ax.set_xscale('log')
     ax.set_yscale('log')
     ax.set_xticks(ticks)
@@ -93,8 +81,59 @@ if __name__ == '__main__':
         ax.set_ylabel('shared with ' + args.lb + ' (' + unit + ')')
     plt.gcf().subplots_adjust(bottom=0.15)
     # plt.gcf().tight_layout()
-    if args.o:
-        pp.savefig()
+    # pdf files are written through PdfPages while any other format (e.g. png) is chosen from the file extension
+    if args.o and args.o.lower().endswith('.pdf'):
+        pp = PdfPages(args.o)
+        pp.savefig(dpi = args.dpi)
         pp.close()
+    elif args.o:
+        plt.savefig(args.o, dpi = args.dpi)
     else:
         plt.show()
+    plt.close('all')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Creates a plot of sharing (26 Jun 2016)', add_help = False, usage = 'matches2plot.py -a <table1> -b <table2> [options]')
+    parser.add_argument('-a', metavar = '<FILE>', type = str, help = 'table1')
+    parser.add_argument('-b', metavar = '<FILE>', type = str, help = 'table2')
+    parser.add_argument('-l', metavar = '<STR>', type = str, help = 'title')
+    parser.add_argument('-la', metavar = '<STR>', type = str, help = 'label1')
+    parser.add_argument('-lb', metavar = '<STR>', type = str, help = 'label2')
+    parser.add_argument('-fs', metavar = '<INT>', type = int, default = 16, help = 'font size')
+    parser.add_argument('-x', action = 'store_true', default = False, help = 'whether to rasterize the points in pdf output [False]')
+    parser.add_argument('-dpi', metavar = '<INT>', type = int, default = 300, help = 'resolution of png output and of rasterized points [300]')
+    parser.add_argument('-o', metavar = '<FILE>', type = str, help = 'output pdf or png file')
+    parser.add_argument('-batch', metavar = '<FILE>', type = str, help = 'file with the options of one plot per line to render within a single process')
+
+    # extract arguments from the command line
+    try:
+        parser.error = parser.exit
+        args = parser.parse_args()
+    except SystemExit:
+        parser.print_help()
+        exit(2)
+
+    if not args.batch and not (args.a and args.b):
+        parser.print_help()
+        exit(2)
+
+    # the Agg backend is selected before pyplot is imported so that no display is needed when writing to files
+    if args.o or args.batch:
+        matplotlib.use('Agg')
+
+    # each line of the batch file is parsed with the options from the command line as defaults
+    if args.batch:
+        with open(args.batch) as f:
+            lines = [line for line in f if line.strip() and not line.startswith('#')]
+        for i, line in enumerate(lines):
+            try:
+                plot_args = parser.parse_args(shlex.split(line), copy.copy(args))
+            except SystemExit:
+                sys.stderr.write('Warning: could not parse line ' + str(i + 1) + ' of the batch file\n')
+                continue
+            if not (plot_args.a and plot_args.b and plot_args.o):
+                sys.stderr.write('Warning: line ' + str(i + 1) + ' of the batch file needs two tables and an output file\n')
+                continue
+            plot(plot_args)
+    else:
+        plot(args)
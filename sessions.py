@@ -0,0 +1,125 @@
+"""
+   sessions.py - Transport and checkpoint helpers shared by the download sessions
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import sys, time, json, threading, random
+from urllib.parse import urlparse
+
+try:
+    import requests
+except ImportError:
+    sys.stderr.write('You need to install the requests module first\n')
+    sys.stderr.write('(run this in your terminal: "python3 -m pip install requests" or "python3 -m pip install --user requests")\n')
+    exit(2)
+
+# the Session classes of getmyancestrydna.py and getmy23andme.py share how requests are sent, retried, throttled and saved
+class BaseSession:
+    def __init__(self, verbose, logfile, timeout, connect_timeout = 10, backoff = 1.0, max_backoff = 300, workers = 1, rate = None, checkpoint = None, resume = False):
+        self.verbose = verbose
+        self.logfile = logfile
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_request = dict()
+        self.open_checkpoint(checkpoint, resume)
+        self.stats = { 'requests': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0 }
+        # the session is shared across worker threads so its pool needs one connection per worker
+        self.pool_size = max(workers, 10)
+        self.s = self.new_session()
+
+    # connections are kept alive in a pool shared by all threads and responses are requested gzip compressed
+    def new_session(self):
+        s = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = self.pool_size, pool_maxsize = self.pool_size)
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        s.headers.update({ 'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive' })
+        return s
+
+    # this function sends a single request with separate connect and read timeouts and records its latency and size
+    def send(self, method, url, **kwargs):
+        start = time.time()
+        try:
+            r = self.s.request(method, url, timeout = (self.connect_timeout, self.timeout), **kwargs)
+        finally:
+            with self.lock:
+                self.stats['requests'] += 1
+                self.stats['seconds'] += time.time() - start
+        with self.lock:
+            self.stats['bytes'] += len(r.content)
+        return r
+
+    # exponential back-off with full jitter before retrying a failed request
+    # (the exponent is capped so that the delay never overflows however many times a request fails)
+    def wait(self, attempt):
+        with self.lock:
+            self.stats['retries'] += 1
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** min(attempt, 30))))
+
+    # cache hits and misses are only reported by sessions that keep a response cache
+    def print_stats(self):
+        latency = self.stats['seconds'] / self.stats['requests'] if self.stats['requests'] else 0
+        line = 'Requests: ' + str(self.stats['requests']) + ', retries: ' + str(self.stats['retries']) + ', bytes: ' + str(self.stats['bytes']) + ', mean latency: ' + '%.3f' % latency + ' seconds'
+        if 'hits' in self.stats:
+            line += ', cache hits: ' + str(self.stats['hits']) + ', cache misses: ' + str(self.stats['misses'])
+        self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: ' + line + '\n')
+
+    # responses are appended to the checkpoint file as they arrive, one JSON object per line
+    # (when resuming, responses already in the file are loaded and never requested again, while new responses are only written to the file)
+    # (otherwise the file must not exist yet so that saved responses are never overwritten)
+    def open_checkpoint(self, checkpoint, resume):
+        self.store = dict()
+        self.checkpoint = None
+        if not checkpoint:
+            return
+        if resume:
+            try:
+                with open(checkpoint, 'r', encoding = 'UTF-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError: # the last line might have been truncated by a crash
+                            continue
+                        self.store[entry['url']] = entry['response']
+            except FileNotFoundError:
+                pass
+            if self.verbose:
+                self.logfile.write('[' + time.strftime("%Y-%m-%d %H:%M:%S") + ']: Loaded ' + str(len(self.store)) + ' responses from: ' + checkpoint + '\n')
+        self.checkpoint = open(checkpoint, 'a' if resume else 'x', encoding = 'UTF-8')
+
+    def save_checkpoint(self, url, response):
+        if not self.checkpoint:
+            return
+        with self.lock:
+            self.checkpoint.write(json.dumps({ 'url': url, 'response': response }) + '\n')
+            self.checkpoint.flush()
+
+    # wait until the per-host rate cap allows another request
+    def throttle(self, url):
+        if not self.rate:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_request.get(host, now))
+            self.next_request[host] = start + 1.0 / self.rate
+        time.sleep(start - now)
@@ -0,0 +1,27 @@
+"""
+   tables.py - Building of output tables from downloaded records
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import pandas as pd
+
+# this function builds a table from a list of records in a single step
+# (columns in keys come first and any other field found in the records is appended after them)
+def records_to_frame(records, keys):
+    df = pd.DataFrame.from_records(records)
+    return df.reindex(columns = keys + [key for key in df.columns if not key in keys])
@@ -0,0 +1,195 @@
+"""
+   test_getmyancestrydna.py - Tests of getmyancestrydna.py against a local mock AncestryDNA server
+   Copyright (C) 2015 Giulio Genovese (giulio.genovese@gmail.com)
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+   Written by Giulio Genovese <giulio.genovese@gmail.com>
+"""
+
+import io, os, json, time, threading, tempfile, collections, unittest, http.server, pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+import getmyancestrydna
+
+# the mock server serves a number of tests that all share the same matches, sorted by decreasing centimorgans
+# (each match shares matches in common with the matches with the same index modulo 7 and the first two matches are the parents)
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path[len('/dna/secure/'):].split('/')
+        query = parse_qs(url.query)
+        kind = path[-1] if path[-1] in ['tests', 'parents', 'testInfo', 'matches', 'matchesInCommon', 'ethnicity'] else 'matchInfo'
+        with server.lock:
+            server.hits[kind] += 1
+            fail = server.fail_once and not self.path in server.failed
+            server.failed.add(self.path)
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if kind == 'tests':
+            data = { 'data': { 'completeTests': [{ 'guid': guid, 'testAdminUcdmId': 'UCDM', 'testSubject': { 'givenNames': guid } } for guid in server.tests] } }
+        elif kind == 'parents':
+            data = { 'father': { 'testGuid': server.matches[0]['testGuid'] }, 'mother': { 'testGuid': server.matches[1]['testGuid'] } }
+        elif kind == 'testInfo':
+            data = { 'givenNames': path[1], 'surname': 'Test', 'gender': 'Female' }
+        elif kind in ['matches', 'matchesInCommon']:
+            matches = server.matches
+            if kind == 'matchesInCommon':
+                k = int(query['matchTestGuid'][0][1:])
+                matches = [match for match in matches if int(match['testGuid'][1:]) % 7 == k % 7 and match['testGuid'] != query['matchTestGuid'][0]]
+            page = int(query['page'][0])
+            data = { 'pageCount': max(1, -(-len(matches) // server.page_size)), 'matchGroups': [{ 'matches': matches[(page - 1) * server.page_size:page * server.page_size] }] }
+        elif kind == 'ethnicity':
+            data = { 'regions': ['europe', path[3]] }
+        else:
+            data = { 'cadGroups': None, 'sharedSegments': int(path[3][1:]) % 5 + 1 }
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MockSession(getmyancestrydna.Session):
+    def login(self):
+        self.cookies = dict()
+
+class TestGetMyAncestryDNA(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        self.server.lock = threading.Lock()
+        self.server.hits = collections.Counter()
+        self.server.fail_once = False
+        self.server.failed = set()
+        self.server.page_size = 50
+        self.server.tests = ['T0', 'T1']
+        self.server.matches = [{ 'testGuid': 'M%03d' % i, 'sharedCentimorgans': 3000.0 / (i + 1), 'meiosisValue': min(i // 20 + 1, 11), 'lastLoggedInDate': '2016-06-0' + str(i % 9 + 1), 'hasHint': i % 3 == 0 } for i in range(250)]
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def session(self, **kwargs):
+        urlpfx = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/dna/secure/'
+        kwargs = dict({ 'urlpfx': urlpfx, 'backoff': 0.01 }, **kwargs)
+        return MockSession('user', 'password', False, io.StringIO(), 10, **kwargs)
+
+    def download(self, session, out, workers = 1, tests = 1, **kwargs):
+        with ThreadPoolExecutor(workers) as executor, ThreadPoolExecutor(tests) as tests_executor:
+            list(tests_executor.map(lambda guid: getmyancestrydna.download_test(session, executor, guid, out, True, logfile = io.StringIO(), **kwargs), self.server.tests))
+        return { guid: pd.read_csv(out + '.' + guid + '.tsv', sep = '\t', index_col = 'testGuid').sort_index() for guid in self.server.tests }
+
+    def test_concurrent_download_matches_serial_download(self):
+        serial = self.download(self.session(), os.path.join(self.dir.name, 'serial'))
+        concurrent = self.download(self.session(workers = 6), os.path.join(self.dir.name, 'concurrent'), workers = 4, tests = 2)
+        for guid in self.server.tests:
+            pd.testing.assert_frame_equal(serial[guid], concurrent[guid])
+            self.assertEqual(len(serial[guid]), 251)
+            self.assertTrue(serial[guid].loc['M007', 'patside'])
+            self.assertFalse(serial[guid].loc['M007', 'matside'])
+            self.assertEqual(serial[guid].loc['M008', 'matchesInCommon'].split(','), ['M001', 'M015'] + ['M%03d' % i for i in range(22, 250, 7)])
+
+    def test_shared_match_ethnicity_is_downloaded_once(self):
+        session = self.session(workers = 6)
+        self.download(session, os.path.join(self.dir.name, 'out'), workers = 4, tests = 2)
+        self.assertEqual(self.server.hits['ethnicity'], 250)
+        self.assertEqual(self.server.hits['matchInfo'], 500)
+        self.assertEqual(session.stats['hits'], 250)
+        self.assertTrue(all(key.startswith('ethnicity:') for key in session.cache))
+
+    def test_resume_downloads_nothing_already_in_checkpoint(self):
+        checkpoint = os.path.join(self.dir.name, 'checkpoint.jsonl')
+        first = self.download(self.session(workers = 6, checkpoint = checkpoint), os.path.join(self.dir.name, 'first'), workers = 4, tests = 2)
+        self.server.hits.clear()
+        second = self.download(self.session(workers = 6, checkpoint = checkpoint, resume = True), os.path.join(self.dir.name, 'second'), workers = 4, tests = 2)
+        self.assertEqual(sum(self.server.hits.values()), 0)
+        for guid in self.server.tests:
+            pd.testing.assert_frame_equal(first[guid], second[guid])
+
+    def test_existing_checkpoint_is_not_overwritten(self):
+        checkpoint = os.path.join(self.dir.name, 'checkpoint.jsonl')
+        session = self.session(checkpoint = checkpoint)
+        self.download(session, os.path.join(self.dir.name, 'out'))
+        self.assertEqual(len(session.store), 0)
+        size = os.path.getsize(checkpoint)
+        with self.assertRaises(FileExistsError):
+            self.session(checkpoint = checkpoint)
+        self.assertEqual(os.path.getsize(checkpoint), size)
+
+    def test_rate_cap_spaces_concurrent_requests(self):
+        session = self.session(workers = 8, rate = 50)
+        start = time.time()
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda guid: session.get_match_info('T0', guid['testGuid']), self.server.matches[:26]))
+        self.assertGreaterEqual(time.time() - start, 25 / 50.0 * 0.9)
+        self.assertEqual(self.server.hits['matchInfo'], 26)
+
+    def test_503_responses_are_retried(self):
+        self.server.fail_once = True
+        session = self.session()
+        matches = session.get_matches('T0')
+        self.assertEqual([match['testGuid'] for match in matches], [match['testGuid'] for match in self.server.matches])
+        self.assertEqual(session.stats['retries'], 5)
+        self.assertEqual(self.server.hits['matches'], 10)
+
+    def test_paging_stops_below_thresholds(self):
+        session = self.session()
+        matches = session.get_matches('T0', mincm = 25)
+        self.assertEqual(len(matches), 120)
+        self.assertEqual(self.server.hits['matches'], 3)
+        matches = session.get_matches('T1', maxmeiosis = 2)
+        self.assertEqual(len(matches), 40)
+        self.assertEqual(self.server.hits['matches'], 4)
+        matches = session.get_matches('T0', mincm = 20)
+        self.assertEqual(len(matches), 150)
+        self.assertEqual(self.server.hits['matches'], 8)
+
+    def test_matches_below_shared_threshold_are_on_neither_side(self):
+        df = self.download(self.session(), os.path.join(self.dir.name, 'out'), shared_mincm = 100)['T0']
+        self.assertEqual(self.server.hits['matchInfo'], 60)
+        self.assertFalse(df['patside'].isnull().any() or df['matside'].isnull().any())
+        self.assertFalse(df.loc['M100', 'patside'] or df.loc['M100', 'matside'])
+        self.assertTrue(pd.isnull(df.loc['M100', 'matchesInCommon']))
+        self.assertTrue(df.loc['M007', 'patside'])
+
+    def test_matches_below_previous_shared_threshold_are_downloaded(self):
+        out = os.path.join(self.dir.name, 'out')
+        self.download(self.session(), out, shared_mincm = 100)
+        self.server.hits.clear()
+        df = self.download(self.session(), os.path.join(self.dir.name, 'new'), prefix = out)['T0']
+        self.assertEqual(self.server.hits['matchInfo'], 440)
+        self.assertTrue(df.loc['M105', 'patside'])
+        self.assertEqual(df.loc['M105', 'matchesInCommon'].split(',')[0], 'M000')
+
+    def test_unchanged_previous_matches_are_reused(self):
+        out = os.path.join(self.dir.name, 'out')
+        self.download(self.session(), out)
+        self.server.hits.clear()
+        self.server.matches[5] = dict(self.server.matches[5], sharedCentimorgans = str(self.server.matches[5]['sharedCentimorgans']))
+        self.server.matches[6] = dict(self.server.matches[6], sharedCentimorgans = 1.0)
+        self.download(self.session(), os.path.join(self.dir.name, 'new'), prefix = out)
+        self.assertEqual(self.server.hits['ethnicity'], 1)
+        self.assertEqual(self.server.hits['matchInfo'], 2)
+
+if __name__ == '__main__':
+    unittest.main()